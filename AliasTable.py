@@ -0,0 +1,48 @@
+# Class drawing indices of a discrete distribution in constant time per
+# draw with the alias method (Vose): the table is built once from the
+# probabilities; a draw picks a column uniformly and returns either the
+# column index or its alias
+
+import numpy
+
+
+class AliasTable:
+    def __init__(self, probabilities):
+        probabilities = numpy.asarray(probabilities, dtype=float)
+        if len(probabilities) == 0 or numpy.any(probabilities < 0) or not numpy.sum(probabilities) > 0:
+            raise ValueError("AliasTable: probabilities have to be non-negative with positive sum")
+        n = len(probabilities)
+        scaled = probabilities * n / numpy.sum(probabilities)
+        self.probability = numpy.ones(n)
+        self.alias = numpy.arange(n)
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            (less, more) = (small.pop(), large.pop())
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        # columns left over (up to rounding) are full, except those of indices
+        # with zero probability, which must never be returned
+        for i in small + large:
+            if probabilities[i] > 0:
+                self.probability[i] = 1.
+            else:
+                self.probability[i] = 0.
+                self.alias[i] = numpy.argmax(probabilities)
+
+    def __len__(self):
+        return len(self.probability)
+
+    # returns index for one uniform number u from [0, 1)
+    def sample(self, u):
+        x = u * len(self.probability)
+        column = min(int(x), len(self.probability) - 1)
+        return column if x - column < self.probability[column] else int(self.alias[column])
+
+    # returns array of indices for array of uniform numbers u from [0, 1)
+    def sampleArray(self, u):
+        x = numpy.asarray(u, dtype=float) * len(self.probability)
+        column = numpy.minimum(x.astype(int), len(self.probability) - 1)
+        return numpy.where(x - column < self.probability[column], column, self.alias[column])
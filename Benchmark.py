@@ -0,0 +1,173 @@
+# Benchmark of the stages of the simulation: event generation, propagation
+# to the TOF, dE/dx model, reconstruction and histogram filling. Every stage
+# is timed on the same events (fixed seeds) through the per-event interface
+# (batch size 1) and through the batch interface for larger batch sizes.
+# Events per second and latency per call are saved to a JSON file, which can
+# serve as the baseline of later runs: with --baseline the run fails when a
+# stage is slower than in the baseline by more than the tolerance
+
+import argparse
+import json
+import platform
+import sys
+import timeit
+import ROOT
+import numpy
+from EventGenerator import *
+from EventReconstruction import *
+from PlottingHistograms import *
+from RandomNumberService import *
+
+
+class Benchmark:
+    stages = ("generateEvent", "bothTracksReachTOF", "dEdx", "reconstructEvent", "fill")
+
+    def __init__(self, nEvents=2000, batchSizes=(1, 100, 1000), repeats=3, seed=1):
+        self.nEvents = nEvents
+        self.batchSizes = batchSizes
+        self.repeats = repeats
+        self.seed = seed
+        self.random = RandomNumberService(seed)
+        self.gen = EventGenerator(random=self.random)
+        self.initialState = self.gen.getState()
+        self.reco = EventReconstruction(self.gen.dEdxEngine, expectation=self.gen.dEdxExpectation, random=self.random)
+        self.plotHist = PlottingHistograms(nEvents, "Output/benchmark.root")
+        self.prepare()
+
+    # puts the random number streams (shared by generation and reconstruction)
+    # and GenEx samples to the initial state
+    def resetRandom(self):
+        self.gen.setState(self.initialState)
+
+    # generates and reconstructs the events used as input of stages following the generation
+    def prepare(self):
+        self.resetRandom()
+        self.events = self.gen.generateBatch(self.nEvents)
+        self.reco.reconstructBatch(self.events)
+        masses = numpy.asarray(ParticleId.mass)[self.events.pairID]
+        self.log10bg = numpy.log10(self.events.p / masses[:, numpy.newaxis])
+        self.fourVectors = []
+        self.vertices = []
+        for i in range(self.nEvents):
+            fourVectors = [ROOT.TLorentzVector(), ROOT.TLorentzVector()]
+            for it in range(2):
+                fourVectors[it].SetXYZM(self.events.pVec[i][it][0], self.events.pVec[i][it][1],
+                                        self.events.pVec[i][it][2], masses[i])
+            self.fourVectors.append(fourVectors)
+            self.vertices.append(ROOT.TVector3(*self.events.vrt[i]))
+
+    # returns slices of the events for given batch size
+    def slices(self, batchSize):
+        return [slice(start, min(start + batchSize, self.nEvents)) for start in range(0, self.nEvents, batchSize)]
+
+    # returns copies of the events as EventBatch objects of given size
+    def batches(self, batchSize):
+        batches = []
+        for eventSlice in self.slices(batchSize):
+            batch = EventBatch(eventSlice.stop - eventSlice.start)
+            batch.data[:] = self.events.data[eventSlice]
+            batch.pVec[:] = self.events.pVec[eventSlice]
+            batches.append(batch)
+        return batches
+
+    # returns function running the stage on all events with given batch size
+    # (1: per-event interface) and number of calls it makes
+    def stage(self, name, batchSize):
+        slices = self.slices(batchSize)
+        if name == "generateEvent":
+            if batchSize == 1:
+                return (lambda: [self.gen.generateEvent() for i in range(self.nEvents)]), self.nEvents
+            return (lambda: [self.gen.generateBatch(s.stop - s.start) for s in slices]), len(slices)
+        if name == "bothTracksReachTOF":
+            tracking = self.gen.tracking
+            if batchSize == 1:
+                return (lambda: [tracking.bothTracksReachTOF(self.fourVectors[i], ExclusiveEvent.charge, self.vertices[i])
+                                 for i in range(self.nEvents)]), self.nEvents
+            return (lambda: [tracking.bothTracksReachTOFBatch(self.events.pVec[s], ExclusiveEvent.charge, self.events.vrt[s])
+                             for s in slices]), len(slices)
+        if name == "dEdx":
+            engine = self.gen.dEdxEngine
+            # two calls (most probable value and RMS) per track, two tracks per event
+            if batchSize == 1:
+                return (lambda: [(engine.GetMostProbableZ(x, 1.), engine.GetRmsZ(x, 1.))
+                                 for x in self.log10bg.ravel().tolist()]), 4 * self.nEvents
+            return (lambda: [(engine.GetMostProbableZArray(self.log10bg[s], 1.), engine.GetRmsZArray(self.log10bg[s], 1.))
+                             for s in slices]), 2 * len(slices)
+        batches = self.batches(batchSize) if batchSize > 1 else None
+        if name == "reconstructEvent":
+            if batchSize == 1:
+                return (lambda: [self.reco.reconstructEvent(self.events.event(i)) for i in range(self.nEvents)]), self.nEvents
+            return (lambda: [self.reco.reconstructBatch(batch) for batch in batches]), len(batches)
+        if name == "fill":
+            if batchSize == 1:
+                return (lambda: [self.plotHist.fillEvent(self.events.event(i)) for i in range(self.nEvents)]), self.nEvents
+            return (lambda: [self.plotHist.fillBatch(batch) for batch in batches]), len(batches)
+        raise ValueError("Benchmark::stage: unknown stage " + name)
+
+    # times the stage (best of self.repeats runs) and returns dictionary of results
+    def measure(self, name, batchSize):
+        (function, nCalls) = self.stage(name, batchSize)
+        times = []
+        for repeat in range(self.repeats):
+            self.resetRandom()
+            start = timeit.default_timer()
+            function()
+            times.append(timeit.default_timer() - start)
+        best = min(times)
+        return {"eventsPerSecond": self.nEvents / best, "latency": best / nCalls, "nCalls": nCalls, "times": times}
+
+    # runs all stages (or given ones) for all batch sizes and returns the results
+    def run(self, stages=None):
+        results = {}
+        for name in (stages if stages else self.stages):
+            results[name] = {}
+            for batchSize in self.batchSizes:
+                results[name][str(batchSize)] = self.measure(name, batchSize)
+                print("Benchmark: " + name + ", batch size " + str(batchSize) + ": " +
+                      format(results[name][str(batchSize)]["eventsPerSecond"], '.1f') + " events/s")
+        return {"environment": {"python": platform.python_version(), "numpy": numpy.__version__,
+                                "ROOT": ROOT.gROOT.GetVersion(), "machine": platform.machine()},
+                "config": {"nEvents": self.nEvents, "batchSizes": list(self.batchSizes), "repeats": self.repeats,
+                           "seed": self.seed},
+                "results": results}
+
+    # compares results with baseline results and returns list of regressions,
+    # i.e. stages and batch sizes with rate lower than (1 - tolerance) times the baseline one
+    @staticmethod
+    def compare(results, baseline, tolerance=0.1):
+        regressions = []
+        for name, stageResults in results["results"].items():
+            for batchSize, result in stageResults.items():
+                reference = baseline["results"].get(name, {}).get(batchSize)
+                if reference is None:
+                    continue
+                ratio = result["eventsPerSecond"] / reference["eventsPerSecond"]
+                if ratio < 1 - tolerance:
+                    regressions.append(name + ", batch size " + batchSize + ": " +
+                                       format(result["eventsPerSecond"], '.1f') + " events/s, baseline " +
+                                       format(reference["eventsPerSecond"], '.1f') + " events/s")
+        return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the simulation")
+    parser.add_argument("--nEvents", type=int, default=2000)
+    parser.add_argument("--batchSizes", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--stages", nargs="+", default=None, choices=Benchmark.stages)
+    parser.add_argument("--output", default="Output/benchmark.json", help="JSON file with results")
+    parser.add_argument("--baseline", default=None, help="JSON file with results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative slowdown")
+    args = parser.parse_args()
+    results = Benchmark(args.nEvents, args.batchSizes, args.repeats, args.seed).run(args.stages)
+    with open(args.output, "w") as outputFile:
+        json.dump(results, outputFile, indent=1, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as baselineFile:
+            regressions = Benchmark.compare(results, json.load(baselineFile), args.tolerance)
+        for regression in regressions:
+            print("Benchmark: regression in " + regression)
+        if regressions:
+            sys.exit(1)
+        print("Benchmark: no regression with respect to " + args.baseline)
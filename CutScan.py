@@ -0,0 +1,212 @@
+# Scan of the PID selection of PidSelector over a grid of nSigma thresholds
+# and m^2_TOF windows of protons and kaons, written as ROC-style CSV tables
+
+import argparse
+import csv
+import multiprocessing
+import os
+import numpy
+from ParticleId import *
+from PidSelector import *
+from PidEfficiency import *
+
+
+# columns of the scanned events sorted by m^2 (see CutScan.columns),
+# set in every worker process by initScan
+scanColumns = None
+
+
+def initScan(columns):
+    global scanColumns
+    scanColumns = columns
+
+
+# returns sums of weights of events with m^2 strictly inside windows (array
+# (n, 2)), sortedValues are m^2 values sorted in ascending order (NaN at the end)
+def windowCounts(sortedValues, weights, windows):
+    cumulative = numpy.concatenate(([0.], numpy.cumsum(weights)))
+    low = numpy.searchsorted(sortedValues, windows[:, 0], side='right')
+    high = numpy.searchsorted(sortedValues, windows[:, 1], side='left')
+    return numpy.where(high > low, cumulative[high] - cumulative[numpy.minimum(low, high)], 0.)
+
+
+# returns matrices of generated vs. reconstructed species (PidSelector.FAILED
+# included), shape (number of proton windows, number of kaon windows, 3, 4),
+# of sums of weights and of squared weights for one nSigma threshold;
+# task is (threshold, proton windows, kaon windows)
+def scanThreshold(task):
+    (cut, protonWindows, kaonWindows) = task
+    (pairID, sqRootNSigma, maxPionNSigma, mSquared, weights) = scanColumns
+    (pion, kaon, proton) = (sqRootNSigma[:, ParticleId.PION], sqRootNSigma[:, ParticleId.KAON],
+                            sqRootNSigma[:, ParticleId.PROTON])
+    protonNSigma = (pion > cut) & (kaon > cut) & (proton < cut)
+    kaonNSigma = (pion > cut) & (kaon < cut) & (proton > cut)
+    pionNSigma = maxPionNSigma < cut
+    shape = (len(protonWindows), len(kaonWindows), len(ParticleId.mass), PidSelector.FAILED + 1)
+    results = []
+    for eventWeights in (weights, weights * weights):
+        def count(selected, windows):
+            return windowCounts(mSquared[selected], eventWeights[selected], windows)
+
+        counts = numpy.zeros(shape)
+        for pid in range(len(ParticleId.mass)):
+            ofSpecies = pairID == pid
+            protonIdentified = count(ofSpecies & protonNSigma, protonWindows)
+            kaonIdentified = count(ofSpecies & kaonNSigma, kaonWindows)
+            # pion candidates identified as protons or kaons
+            pionAsProton = count(ofSpecies & pionNSigma & protonNSigma, protonWindows)
+            pionAsKaon = count(ofSpecies & pionNSigma & kaonNSigma, kaonWindows)
+            counts[:, :, pid, ParticleId.PROTON] = protonIdentified[:, numpy.newaxis]
+            counts[:, :, pid, ParticleId.KAON] = kaonIdentified[numpy.newaxis, :]
+            counts[:, :, pid, ParticleId.PION] = numpy.sum(eventWeights[ofSpecies & pionNSigma]) -\
+                                                 pionAsProton[:, numpy.newaxis] - pionAsKaon[numpy.newaxis, :]
+            counts[:, :, pid, PidSelector.FAILED] = numpy.sum(eventWeights[ofSpecies]) -\
+                                                    numpy.sum(counts[:, :, pid, :PidSelector.FAILED], axis=-1)
+        results.append(counts)
+    return results
+
+
+class CutScan:
+    # pairID (n,), nSigma (n, 2, 3), mSquared (n,) and weight (n,) are columns
+    # of reconstructed events (as in EventBatch); weight None means unweighted events
+    def __init__(self, pairID, nSigma, mSquared, weight=None, nProcesses=None):
+        self.nProcesses = nProcesses if nProcesses else multiprocessing.cpu_count()
+        nSigma = numpy.asarray(nSigma, dtype=float)
+        mSquared = numpy.asarray(mSquared, dtype=float)
+        order = numpy.argsort(mSquared, kind='stable')
+        self.columns = (numpy.asarray(pairID)[order],
+                        numpy.sqrt(numpy.sum(nSigma * nSigma, axis=-2))[order],
+                        numpy.max(nSigma[:, :, ParticleId.PION], axis=-1)[order],
+                        mSquared[order],
+                        numpy.ones(len(mSquared)) if weight is None else numpy.asarray(weight, dtype=float)[order])
+        self.counts = None
+        self.squaredCounts = None
+
+    # returns CutScan of all events stored in EventStore directory
+    @staticmethod
+    def fromStore(directory, nProcesses=None):
+        from EventStore import EventStore
+        batches = list(EventStore(directory).chunks())
+        return CutScan(numpy.concatenate([batch.pairID for batch in batches]),
+                       numpy.concatenate([batch.nSigma for batch in batches]),
+                       numpy.concatenate([batch.mSquared for batch in batches]),
+                       numpy.concatenate([batch.weight for batch in batches]), nProcesses)
+
+    # returns array (n, 2) of all windows (low, high) with low < high
+    @staticmethod
+    def windows(lows, highs):
+        return numpy.array([(low, high) for low in lows for high in highs if low < high], dtype=float).reshape(-1, 2)
+
+    # returns values from start to stop (included) with given step
+    @staticmethod
+    def values(start, stop, step):
+        return numpy.arange(start, stop + step / 2, step)
+
+    # evaluates the selection for all combinations of nSigma thresholds and
+    # m^2 windows (arrays (n, 2)) of protons and kaons; counts of generated vs.
+    # reconstructed species (sums of weights) are stored in self.counts, shape
+    # (thresholds, proton windows, kaon windows, 3, 4), sums of squared weights
+    # in self.squaredCounts
+    def run(self, thresholds, protonWindows, kaonWindows):
+        self.thresholds = numpy.asarray(thresholds, dtype=float)
+        self.protonWindows = numpy.asarray(protonWindows, dtype=float).reshape(-1, 2)
+        self.kaonWindows = numpy.asarray(kaonWindows, dtype=float).reshape(-1, 2)
+        tasks = [(cut, self.protonWindows, self.kaonWindows) for cut in self.thresholds]
+        if self.nProcesses == 1:
+            initScan(self.columns)
+            results = [scanThreshold(task) for task in tasks]
+        else:
+            pool = multiprocessing.Pool(min(self.nProcesses, len(tasks)), initializer=initScan,
+                                        initargs=(self.columns,))
+            try:
+                results = pool.map(scanThreshold, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        self.counts = numpy.array([counts for (counts, squaredCounts) in results])
+        self.squaredCounts = numpy.array([squaredCounts for (counts, squaredCounts) in results])
+        return self.counts
+
+    # efficiencies with lower and upper uncertainties, each of shape
+    # (thresholds, proton windows, kaon windows, 3)
+    def efficiencies(self, efficiency=None):
+        efficiency = efficiency if efficiency is not None else PidEfficiency()
+        diagonal = numpy.diagonal(self.counts, axis1=-2, axis2=-1)
+        return efficiency.interval(diagonal, numpy.sum(self.counts, axis=-1), numpy.sum(self.squaredCounts, axis=-1))
+
+    # purities with lower and upper uncertainties, shapes as in efficiencies
+    def purities(self, efficiency=None):
+        efficiency = efficiency if efficiency is not None else PidEfficiency()
+        diagonal = numpy.diagonal(self.counts, axis1=-2, axis2=-1)
+        return efficiency.interval(diagonal, numpy.sum(self.counts, axis=-2)[..., :len(ParticleId.mass)],
+                                   numpy.sum(self.squaredCounts, axis=-2)[..., :len(ParticleId.mass)])
+
+    # returns header and rows (one per grid point) of the table of cut values,
+    # efficiencies and purities of all species
+    def table(self):
+        header = ["nSigma", "mSquaredProtonLow", "mSquaredProtonHigh", "mSquaredKaonLow", "mSquaredKaonHigh"]
+        for name in ParticleId.name:
+            header += ["efficiency_" + name, "efficiencyError_" + name, "purity_" + name]
+        (efficiency, efficiencyLow, efficiencyHigh) = self.efficiencies()
+        purity = self.purities()[0]
+        rows = []
+        for index in numpy.ndindex(self.counts.shape[:3]):
+            (threshold, protonWindow, kaonWindow) = index
+            row = [self.thresholds[threshold]] + list(self.protonWindows[protonWindow]) + list(self.kaonWindows[kaonWindow])
+            for pid in range(len(ParticleId.mass)):
+                row += [efficiency[index][pid], 0.5 * (efficiencyLow[index][pid] + efficiencyHigh[index][pid]),
+                        purity[index][pid]]
+            rows.append(row)
+        return header, rows
+
+    # returns header and rows of the ROC table of species pid: grid points
+    # ordered by decreasing efficiency which have better purity than all
+    # points of higher efficiency
+    def rocTable(self, pid):
+        (header, rows) = self.table()
+        efficiencyColumn = header.index("efficiency_" + ParticleId.name[pid])
+        purityColumn = header.index("purity_" + ParticleId.name[pid])
+        rows = [row for row in rows if numpy.isfinite(row[efficiencyColumn]) and numpy.isfinite(row[purityColumn])]
+        rows.sort(key=lambda row: (-row[efficiencyColumn], -row[purityColumn]))
+        roc = []
+        for row in rows:
+            if not roc or row[purityColumn] > roc[-1][purityColumn]:
+                roc.append(row)
+        return header, roc
+
+    # writes cutScan.csv (all grid points) and cutScanRoc_<species>.csv
+    # to outputDir and returns names of the files
+    def writeTables(self, outputDir="Output"):
+        if not os.path.exists(outputDir):
+            os.makedirs(outputDir)
+        tables = [("cutScan.csv", self.table())] +\
+                 [("cutScanRoc_" + name + ".csv", self.rocTable(pid)) for pid, name in enumerate(ParticleId.name)]
+        fileNames = []
+        for (fileName, (header, rows)) in tables:
+            fileNames.append(os.path.join(outputDir, fileName))
+            with open(fileNames[-1], "w") as tableFile:
+                writer = csv.writer(tableFile)
+                writer.writerow(header)
+                for row in rows:
+                    writer.writerow([format(value, '.6g') for value in row])
+        return fileNames
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Scan PID cuts on events stored in an EventStore")
+    parser.add_argument("directory", help="EventStore directory")
+    parser.add_argument("--nSigma", type=float, nargs=3, default=[1., 5., 0.25], metavar=("START", "STOP", "STEP"),
+                        help="nSigma thresholds (STOP included)")
+    parser.add_argument("--protonLow", type=float, nargs=3, default=[0.5, 0.9, 0.05], metavar=("START", "STOP", "STEP"))
+    parser.add_argument("--protonHigh", type=float, nargs=3, default=[0.9, 1.3, 0.05], metavar=("START", "STOP", "STEP"))
+    parser.add_argument("--kaonLow", type=float, nargs=3, default=[0.1, 0.3, 0.02], metavar=("START", "STOP", "STEP"))
+    parser.add_argument("--kaonHigh", type=float, nargs=3, default=[0.24, 0.44, 0.02], metavar=("START", "STOP", "STEP"))
+    parser.add_argument("--processes", type=int, default=None, help="number of processes (default: number of cores)")
+    parser.add_argument("--outputDir", default="Output", help="directory for the tables")
+    args = parser.parse_args()
+    scan = CutScan.fromStore(args.directory, args.processes)
+    scan.run(CutScan.values(*args.nSigma),
+             CutScan.windows(CutScan.values(*args.protonLow), CutScan.values(*args.protonHigh)),
+             CutScan.windows(CutScan.values(*args.kaonLow), CutScan.values(*args.kaonHigh)))
+    for fileName in scan.writeTables(args.outputDir):
+        print("CutScan: written " + fileName)
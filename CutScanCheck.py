@@ -0,0 +1,62 @@
+# Cross-check of CutScan: on synthetic weighted events the counts of every
+# grid point are compared with those of PidSelector.classify at the same cuts
+
+import argparse
+import sys
+import numpy
+from ParticleId import *
+from PidSelector import *
+from CutScan import *
+
+
+# returns columns (pairID, nSigma, mSquared, weight) of nEvents synthetic events;
+# m^2 values are rounded to 0.01, so that some of them lie on the window edges,
+# and some of them are NaN (m^2_TOF not reconstructed)
+def syntheticEvents(nEvents, seed):
+    random = numpy.random.Generator(numpy.random.Philox(seed))
+    pairID = random.integers(0, len(ParticleId.mass), nEvents)
+    nSigma = random.normal(0., 3., (nEvents, 2, len(ParticleId.mass)))
+    nSigma[numpy.arange(nEvents), :, pairID] *= 0.3
+    mSquared = numpy.round(numpy.asarray(ParticleId.mass)[pairID] ** 2 + random.normal(0., 0.15, nEvents), 2)
+    mSquared[random.random(nEvents) < 0.05] = numpy.nan
+    weight = random.exponential(1., nEvents)
+    return pairID, nSigma, mSquared, weight
+
+
+# returns matrices of generated vs. reconstructed species of PidSelector at the
+# grid point (sums of weights and of squared weights)
+def selectorCounts(pairID, nSigma, mSquared, weight, cut, protonWindow, kaonWindow):
+    selector = PidSelector({"nSigma": cut, "mSquaredProton": tuple(protonWindow), "mSquaredKaon": tuple(kaonWindow)})
+    pidReco = selector.classify(nSigma, mSquared)[1]
+    counts = numpy.zeros((len(ParticleId.mass), PidSelector.FAILED + 1))
+    squaredCounts = numpy.zeros(counts.shape)
+    numpy.add.at(counts, (pairID, pidReco), weight)
+    numpy.add.at(squaredCounts, (pairID, pidReco), weight * weight)
+    return counts, squaredCounts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare CutScan with PidSelector on synthetic events")
+    parser.add_argument("--events", type=int, default=20000, help="number of synthetic events")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic events")
+    args = parser.parse_args()
+    (pairID, nSigma, mSquared, weight) = syntheticEvents(args.events, args.seed)
+    thresholds = CutScan.values(1., 5., 0.5)
+    protonWindows = CutScan.windows(CutScan.values(0.5, 0.9, 0.1), CutScan.values(0.9, 1.3, 0.1))
+    kaonWindows = CutScan.windows(CutScan.values(0.1, 0.3, 0.05), CutScan.values(0.2, 0.45, 0.05))
+    failed = 0
+    for nProcesses in (1, 2):
+        scan = CutScan(pairID, nSigma, mSquared, weight, nProcesses)
+        scan.run(thresholds, protonWindows, kaonWindows)
+        for index in numpy.ndindex(scan.counts.shape[:3]):
+            (threshold, protonWindow, kaonWindow) = index
+            (counts, squaredCounts) = selectorCounts(pairID, nSigma, mSquared, weight, thresholds[threshold],
+                                                     protonWindows[protonWindow], kaonWindows[kaonWindow])
+            if not (numpy.allclose(scan.counts[index], counts) and numpy.allclose(scan.squaredCounts[index], squaredCounts)):
+                failed += 1
+        print("CutScanCheck: " + str(nProcesses) + " process(es), " + str(scan.counts[..., 0, 0].size) +
+              " grid points compared")
+    if failed:
+        print("CutScanCheck: " + str(failed) + " grid points differ from PidSelector")
+        sys.exit(1)
+    print("CutScanCheck: all grid points agree with PidSelector")
@@ -0,0 +1,26 @@
+# Class representing a batch of 2-particle exclusive events stored
+# column-wise (structure of arrays); the first axis of every array
+# runs over the events of the batch. Columns are views into one
+# structured array self.data with the ExclusiveEvent.dtype layout
+
+from ParticleId import *
+from ExclusiveEvent import *
+import numpy
+
+
+class EventBatch:
+    def __init__(self, nEvents):
+        self.nEvents = nEvents
+        self.data = numpy.zeros(nEvents, dtype=ExclusiveEvent.dtype)
+        for name in ExclusiveEvent.dtype.names:
+            setattr(self, name, self.data[name])
+        self.weight[:] = 1.
+        self.charge = numpy.array(ExclusiveEvent.charge)
+        self.pVec = numpy.empty([nEvents, 2, 3], dtype=float)
+
+    def __len__(self):
+        return self.nEvents
+
+    # returns i-th event of the batch as ExclusiveEvent sharing the data of the batch
+    def event(self, i):
+        return ExclusiveEvent(int(self.pairID[i]), self.vrt[i], self.data[i])
@@ -1,88 +1,243 @@
 # Class representing "data factory". Generates exclusive events
-# according to GenEx Monte Carlo, accounting for detector acceptance
+# according to GenEx Monte Carlo, accounting for detector acceptance,
+# optionally importance-weighted (see biasGenEx and getWeights)
 
 import ROOT
 import numpy
+import os
+import timeit
 from dEdxParametrisation import *
+from dEdxExpectation import *
+from dEdxSampler import *
+from AliasTable import *
 from StarDetectorAcceptance import *
 from ExclusiveEvent import *
+from EventBatch import *
 from TrackingSimulation import *
+from GenExSample import *
+from RandomNumberService import *
 
 
 class EventGenerator:
-    # constructor
-    def __init__(self):
-        self.dEdxEngine = dEdxParametrisation()
-        self.tracking = TrackingSimulation()
-        self.randomNumGen = ROOT.TRandom3(0)
+    # constructor; random (default: RandomNumberService of seed) may be shared with the reconstruction,
+    # field is a MagneticField, for the other options see GenExSample, preFilterGenEx, dEdxSampler, biasGenEx
+    def __init__(self, seed=0, GenExPolicy="wrap", preFilter=True, field=None, dEdxModel="gaussian",
+                 random=None, speciesBias=None, massBias=None):
+        assert dEdxModel in ("gaussian", "bichsel")
+        self.dEdxEngine = dEdxParametrisation(LookupTables=True, CacheDir="dEdxModel/cache")
+        self.dEdxExpectation = dEdxExpectation(self.dEdxEngine)
+        self.dEdxSampler = dEdxSampler(self.dEdxEngine, self.dEdxExpectation) if dEdxModel == "bichsel" else None
+        self.tracking = TrackingSimulation(field=field)
+        self.random = random if random is not None else RandomNumberService(seed)
+        self.GenExSamples = []
+        for pid in range(len(ParticleId.name)):
+            if os.path.exists("GenEx/"+ParticleId.name[pid]+".dat"):
+                self.GenExSamples.append(GenExSample(pid, self.random.stream("genex"), GenExPolicy))
+            else:
+                print("EventGenerator: GenEx sample for " + ParticleId.name[pid] + " not found, " +
+                      ParticleId.name[pid] + " pairs will not be generated")
+                self.GenExSamples.append(None)
+        if preFilter:
+            self.preFilterGenEx()
+        self.massBias = dict(massBias) if massBias is not None else {}
+        self.massNormalisation = {}
+        self.biasGenEx()
+        # GenEx pairs read and rejected (outside acceptance or not reaching
+        # the TOF) per species, time spent in tracking (see RunMonitor)
+        self.nGenExRead = [0] * len(ParticleId.name)
+        self.nGenExRejected = [0] * len(ParticleId.name)
+        self.trackingTime = 0.
         self.particleProbabilities = self.getProbabilities()
-        self.particleLimits = self.getLimits(self.particleProbabilities)
+        self.speciesBias = tuple(speciesBias) if speciesBias is not None else (1.,) * len(ParticleId.name)
+        if len(self.speciesBias) != len(ParticleId.name) or min(self.speciesBias) <= 0:
+            raise ValueError("EventGenerator: speciesBias needs a positive factor for every species")
+        samplingProbabilities = numpy.multiply(self.particleProbabilities, self.speciesBias)
+        samplingProbabilities /= numpy.sum(samplingProbabilities)
+        self.particleSampler = AliasTable(samplingProbabilities)
+        # weights of the species, undoing the species bias
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.speciesWeights = numpy.where(samplingProbabilities > 0,
+                                              self.particleProbabilities / samplingProbabilities, 0.)
+        self.weighted = bool(self.massBias) or numpy.any(numpy.asarray(self.speciesBias) != self.speciesBias[0])
+        self.pairMass = None
         self.VertexParams = [0.015, 0.015, 50.]
-        self.GenExFiles = []
-        for pid in ParticleId.name:
-            self.GenExFiles.append(open("GenEx/"+pid+".dat", "r"))
+        self.eventPool = ExclusiveEventPool()
 
     # main method which generates event (ExclusiveEvent object)
-    # and returns it
+    # and returns it; events are allocated from self.eventPool, so an event
+    # stays valid until eventPool capacity further events are generated
     def generateEvent(self):
         pid = self.generateParticleId()
         vertex = self.generateVertex()
-        evt = ExclusiveEvent(pid, vertex)
+        evt = self.eventPool.allocate(pid, vertex)
         evt.p = self.generateMomentum(pid, evt.charge, vertex)
-        evt.ToFhitPosition = self.tracking.getToFhitPosition()
+        evt.ToFhitPosition = [(hit.X(), hit.Y(), hit.Z()) for hit in self.tracking.getToFhitPosition()]
         evt.R = self.tracking.getTrackRadius()
+        evt.pathLength = self.tracking.getTrackPathLength()
         for it in range(2):
             evt.dEdx[it] = self.generatedEdx(pid, evt.p[it])
+        evt.weight = self.getWeights(pid, self.pairMass) if self.weighted else 1.
         return evt
 
+    # generates a batch of nEvents events at once and returns it as EventBatch
+    # object (columns of numpy arrays), the counterpart of nEvents calls of
+    # generateEvent; both draw the same random numbers per stream, but pairs
+    # rejected by the TOF reach check are replaced differently (see
+    # generateMomentumBatch), so the events are not identical in general
+    def generateBatch(self, nEvents):
+        batch = EventBatch(nEvents)
+        batch.pairID[:] = self.generateParticleIdBatch(nEvents)
+        batch.vrt[:] = self.generateVertexBatch(nEvents)
+        for pid in range(len(ParticleId.name)):
+            selected = numpy.flatnonzero(batch.pairID == pid)
+            if len(selected) > 0:
+                self.generateMomentumBatch(pid, batch, selected)
+        batch.p[:] = numpy.sqrt(numpy.sum(batch.pVec * batch.pVec, axis=2))
+        batch.dEdx[:] = self.generatedEdxBatch(batch.pairID[:, numpy.newaxis], batch.p)
+        return batch
+
     # generates particles momenta according to GenEx output files,
     # checks for STAR detector acceptance - if particles are outside
-    # the acceptance then new set of momenta is loaded (and so on)
+    # the acceptance then new set of momenta is loaded (and so on);
+    # the invariant mass of the pair is kept in self.pairMass (weighted generation)
     def generateMomentum(self, pid, charges, vertex):
         fourVectors = [ROOT.TLorentzVector(), ROOT.TLorentzVector()]
         while True:
-            line = self.GenExFiles[pid].readline()
-            data = map(float, line.split())
+            data = self.GenExSamples[pid].next()
+            self.nGenExRead[pid] += 1
             fourVectors[0].SetXYZM(data[0], data[1], data[2], ParticleId.mass[pid])
             fourVectors[1].SetXYZM(data[3], data[4], data[5], ParticleId.mass[pid])
-            if self.isInAcceptance(fourVectors, pid) and self.tracking.bothTracksReachTOF(fourVectors, charges, vertex):
-                break
+            if self.isInAcceptance(fourVectors, pid):
+                start = timeit.default_timer()
+                reached = self.tracking.bothTracksReachTOF(fourVectors, charges, vertex)
+                self.trackingTime += timeit.default_timer() - start
+                if reached:
+                    break
+            self.nGenExRejected[pid] += 1
+        if self.weighted:
+            self.pairMass = self.getPairMass(pid, data[:6].reshape(1, 2, 3))[0]
         return tuple([fourVectors[0].P(), fourVectors[1].P()])
 
+    # vectorized counterpart of generateMomentum for the events of the batch
+    # with given indices (all of the same pid); each GenEx pair is used once and
+    # pairs failing the acceptance are replaced with the next ones from the file
+    def generateMomentumBatch(self, pid, batch, selected):
+        pending = selected
+        while len(pending) > 0:
+            pairs = self.GenExSamples[pid].nextBlock(len(pending))
+            pVec = pairs[:, :6].reshape(-1, 2, 3)
+            accepted = self.isInAcceptanceBatch(pVec, pid)
+            start = timeit.default_timer()
+            (reached, R, hitPositions, pathLengths) = self.tracking.bothTracksReachTOFBatch(pVec, batch.charge, batch.vrt[pending])
+            self.trackingTime += timeit.default_timer() - start
+            accepted &= reached
+            self.nGenExRead[pid] += len(pending)
+            self.nGenExRejected[pid] += len(pending) - numpy.count_nonzero(accepted)
+            filled = pending[accepted]
+            batch.pVec[filled] = pVec[accepted]
+            batch.R[filled] = R[accepted]
+            batch.ToFhitPosition[filled] = hitPositions[accepted]
+            batch.pathLength[filled] = pathLengths[accepted]
+            batch.weight[filled] = self.getWeights(pid, self.getPairMass(pid, pVec[accepted])) if self.weighted else 1.
+            pending = pending[~accepted]
+
+    # applies the eta/pT acceptance and the track radius cut, which do not depend
+    # on the vertex, to all pairs of the GenEx samples, so that only pairs passing
+    # them are read and propagated to the TOF; the sequence of accepted pairs is
+    # the same as without the pre-filter. Prints acceptance fraction per species
+    def preFilterGenEx(self):
+        for pid, sample in enumerate(self.GenExSamples):
+            if sample is None:
+                continue
+            pVec = sample.allRows()[:, :6].reshape(-1, 2, 3)
+            sample.setSelection(self.isInAcceptanceBatch(pVec, pid) & self.tracking.passRadiusCutBatch(pVec))
+            print("EventGenerator::preFilterGenEx: acceptance of " + ParticleId.name[pid] + " pairs " +
+                  format(100 * sample.acceptanceFraction, '.2f') + "% (" + str(len(sample)) + " of " +
+                  str(sample.nPairs()) + ")")
+
+    # thins the GenEx samples of species with mass bias: a pair of mass m is
+    # kept with probability b(m)/max(b), b being the bias factor, so regions with
+    # larger factors are oversampled relative to the rest of the sample; pairs
+    # are weighted with c/b(m), c being the mean of b over the pairs available
+    # before thinning (see getWeights). The thinning draws come from a stream
+    # of fixed seed, so a resumed run thins the same pairs as the original one
+    def biasGenEx(self):
+        for pid, sample in enumerate(self.GenExSamples):
+            if sample is None or pid not in self.massBias:
+                continue
+            factors = self.getMassBiasFactors(pid, self.getPairMass(pid, sample.allRows()[:, :6].reshape(-1, 2, 3)))
+            selected = numpy.zeros(sample.nPairs(), dtype=bool)
+            selected[sample.selection if sample.selection is not None else slice(None)] = True
+            self.massNormalisation[pid] = numpy.mean(factors[selected])
+            thinning = numpy.random.Generator(numpy.random.Philox(numpy.random.SeedSequence(pid)))
+            kept = thinning.random(sample.nPairs()) * numpy.max(factors[selected]) < factors
+            sample.setSelection(selected & kept)
+            print("EventGenerator::biasGenEx: " + str(len(sample)) + " " + ParticleId.name[pid] + " pairs kept of " +
+                  str(numpy.count_nonzero(selected)) + " after mass bias")
+
+    # returns invariant masses of pairs of species pid with momenta pVec, shape (n, 2, 3)
+    @staticmethod
+    def getPairMass(pid, pVec):
+        energy = numpy.sqrt(numpy.sum(pVec * pVec, axis=2) + ParticleId.mass[pid] ** 2)
+        pairMomentum = numpy.sum(pVec, axis=1)
+        return numpy.sqrt(numpy.maximum(numpy.sum(energy, axis=1) ** 2 - numpy.sum(pairMomentum * pairMomentum, axis=1), 0.))
+
+    # returns bias factors of pairs of species pid with invariant masses mass (array)
+    def getMassBiasFactors(self, pid, mass):
+        (edges, factors) = self.massBias[pid]
+        if len(edges) != len(factors) + 1 or min(factors) <= 0:
+            raise ValueError("EventGenerator: massBias of " + ParticleId.name[pid] +
+                             " needs edges of bins and a positive factor for every bin")
+        index = numpy.searchsorted(edges, mass, side='right') - 1
+        inside = (index >= 0) & (index < len(factors))
+        return numpy.where(inside, numpy.asarray(factors, dtype=float)[numpy.clip(index, 0, len(factors) - 1)], 1.)
+
+    # returns weights of events of species pid with pair masses mass
+    # (scalar or array): the species weight times the mass bias weight
+    def getWeights(self, pid, mass):
+        weights = self.speciesWeights[pid] * numpy.ones(numpy.shape(mass))
+        if pid in self.massNormalisation:
+            weights *= self.massNormalisation[pid] / self.getMassBiasFactors(pid, mass)
+        return weights if numpy.ndim(weights) > 0 else float(weights)
+
     # generates particle momentum loss (dE/dx) based on particle
     # momentum, according to the Bichsel parametrisation tuned to
-    # STAR detector response
+    # STAR detector response (expectations taken from self.dEdxExpectation)
     def generatedEdx(self, pid, p):
-        return 1E-6*ROOT.TMath.Exp(self.randomNumGen.Gaus(
-            self.dEdxEngine.GetMostProbableZ(ROOT.TMath.Log10(p/ParticleId.mass[pid]), 1.),
-            self.dEdxEngine.GetRmsZ(ROOT.TMath.Log10(p/ParticleId.mass[pid]), 1.)/7))
+        if self.dEdxSampler is not None:
+            return float(self.dEdxSampler.sample(pid, p, self.random.uniform("dEdx")))
+        return 1E-6*ROOT.TMath.Exp(self.random.normal("dEdx",
+            float(self.dEdxExpectation.mostProbableZ(pid, p)),
+            float(self.dEdxExpectation.rmsZ(pid, p))/7))
+
+    # vectorized counterpart of generatedEdx, pid and p are arrays (broadcastable)
+    def generatedEdxBatch(self, pid, p):
+        if self.dEdxSampler is not None:
+            shape = numpy.broadcast(pid, p).shape
+            return self.dEdxSampler.sample(pid, p, self.random.uniform("dEdx", shape))
+        (mostProbableZ, rmsZ) = self.dEdxExpectation.expectation(pid, p)
+        return 1E-6*numpy.exp(self.random.normal("dEdx", mostProbableZ, rmsZ/7))
 
     # generates particle ID (in fact, ID of particles in an exclusive pair) according to
-    # the yields reconstructed in the data
+    # the yields reconstructed in the data (drawn from alias table self.particleSampler)
     def generateParticleId(self):
-        x = self.randomNumGen.Uniform()
-        for upperBound in self.particleLimits:
-            if x <= upperBound:
-                return self.particleLimits.index(upperBound)
-        return ParticleId.PION
+        return self.particleSampler.sample(self.random.uniform("pid"))
+
+    # generates array of nEvents particle IDs
+    def generateParticleIdBatch(self, nEvents):
+        return self.particleSampler.sampleArray(self.random.uniform("pid", nEvents))
 
     # extract relative yields of particles according to distributions from the data
+    # (species without GenEx sample get zero probability)
     def getProbabilities(self):
         file = ROOT.TFile("dEdxData.root")
         eventCounts = []
-        for pid in ParticleId.name:
-            eventCounts.append(file.Get("DEdxVsMomentumPid_" + pid).GetEntries() / 2)
-        return tuple(eventCounts / numpy.sum(eventCounts))
-
-    # calculates numerical limits for the purpose of random PID generation
-    def getLimits(self, pValues):
-        limits = []
-        for p in pValues:
-            if p == pValues[0]:
-                limits.append(p)
+        for pid in range(len(ParticleId.name)):
+            if self.GenExSamples[pid] is None:
+                eventCounts.append(0.)
             else:
-                limits.append(limits[len(limits) - 1] + p)
-        return limits
+                eventCounts.append(file.Get("DEdxVsMomentumPid_" + ParticleId.name[pid]).GetEntries() / 2)
+        return tuple(eventCounts / numpy.sum(eventCounts))
 
     # checks whether the tracks are within acceptance of the central barrel detector
     def isInAcceptance(self, fourVec, pid):
@@ -94,8 +249,36 @@ class EventGenerator:
         else:
             return False
 
+    # vectorized counterpart of isInAcceptance, pVec has shape (n, 2, 3)
+    def isInAcceptanceBatch(self, pVec, pid):
+        pT = numpy.hypot(pVec[:, :, 0], pVec[:, :, 1])
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            eta = numpy.arcsinh(pVec[:, :, 2] / pT)
+        inAcceptance = (StarDetectorAcceptance.etaLimits[0] < eta) & (eta < StarDetectorAcceptance.etaLimits[1]) &\
+                       (pT > StarDetectorAcceptance.pTThreshold[pid])
+        return numpy.all(inAcceptance, axis=1)
+
     # generates vertex position
     def generateVertex(self):
-        return ROOT.TVector3(self.randomNumGen.Gaus(self.VertexParams[0], self.VertexParams[1]),
-                            self.randomNumGen.Gaus(self.VertexParams[0], self.VertexParams[1]),
-                            self.randomNumGen.Gaus(self.VertexParams[0], self.VertexParams[2]))
+        return ROOT.TVector3(*self.random.normal("vertex", [self.VertexParams[0]] * 3,
+                                                 [self.VertexParams[1], self.VertexParams[1], self.VertexParams[2]]))
+
+    # generates array of nEvents vertex positions, shape (nEvents, 3)
+    def generateVertexBatch(self, nEvents):
+        return self.random.normal("vertex", [self.VertexParams[0]] * 3,
+                                  [self.VertexParams[1], self.VertexParams[1], self.VertexParams[2]],
+                                  size=(nEvents, 3))
+
+    # returns JSON-serialisable state of the random number streams and of
+    # the GenEx samples needed to continue the run later (see setState)
+    def getState(self):
+        GenEx = [None if sample is None else [sample.tell(), sample.nPasses] for sample in self.GenExSamples]
+        return {"random": self.random.getState(), "GenEx": GenEx}
+
+    # restores state returned by getState
+    def setState(self, state):
+        self.random.setState(state["random"])
+        for sample, GenEx in zip(self.GenExSamples, state["GenEx"]):
+            if sample is not None:
+                sample.seek(GenEx[0])
+                sample.nPasses = GenEx[1]
@@ -0,0 +1,200 @@
+# Class running the simulation as a stream of generator stages (generate ->
+# reconstruct -> classify -> fill -> store), event by event or in batches,
+# with checkpoints to resume from and an optional stop on PID precision
+
+import json
+import os
+import ROOT
+from RunMonitor import *
+
+
+class EventPipeline:
+    def __init__(self, gen, reco, plotHist, nEvents, checkpointInterval=10000, checkpointFile="Output/checkpoint.root",
+                 eventStore=None, batchSize=None, monitor=None, efficiency=None):
+        self.gen = gen
+        self.reco = reco
+        self.plotHist = plotHist
+        self.pidSelector = plotHist.pidSelector
+        self.eventStore = eventStore
+        self.nEvents = int(nEvents)
+        self.checkpointInterval = checkpointInterval
+        self.checkpointFile = checkpointFile
+        self.batchSize = batchSize
+        self.monitor = monitor if monitor is not None else RunMonitor(nEvents, summaryFile=None)
+        self.efficiency = efficiency
+
+    # runs the pipeline until nEvents events are processed (or the efficiencies
+    # converge, see PidEfficiency.converged); with resume=True the run continues
+    # from the last checkpoint, if there is one. Returns the number of events processed
+    def run(self, resume=True):
+        eventsDone = self.restore() if resume else 0
+        if self.eventStore is not None and eventsDone == 0:
+            self.eventStore.truncate(0)
+        self.monitor.start(eventsDone, self.gen, self.efficiency)
+        if self.batchSize:
+            batches = self.fillBatches(self.classifyBatches(self.reconstructBatches(self.generateBatches(eventsDone))))
+            if self.eventStore is not None:
+                batches = self.storeBatches(batches)
+            for batch in batches:
+                eventsDone += len(batch)
+                self.monitor.update(len(batch))
+                if self.converged(eventsDone):
+                    break
+                if self.checkpointInterval and eventsDone < self.nEvents and\
+                        eventsDone // self.checkpointInterval > (eventsDone - len(batch)) // self.checkpointInterval:
+                    self.checkpoint(eventsDone)
+        else:
+            events = self.fill(self.classify(self.reconstruct(self.generate(eventsDone))))
+            if self.eventStore is not None:
+                events = self.store(events)
+            for evt in events:
+                eventsDone += 1
+                self.monitor.update()
+                if self.converged(eventsDone):
+                    break
+                if self.checkpointInterval and eventsDone % self.checkpointInterval == 0 and eventsDone < self.nEvents:
+                    self.checkpoint(eventsDone)
+        if self.eventStore is not None:
+            self.eventStore.close()
+        if os.path.exists(self.checkpointFile):
+            os.remove(self.checkpointFile)
+        self.monitor.finish()
+        return eventsDone
+
+    # tells whether the run can stop after eventsDone events because the
+    # efficiencies have reached the target precision; the number of events
+    # written with the histograms is then set to eventsDone
+    def converged(self, eventsDone):
+        if self.efficiency is None or eventsDone >= self.nEvents or not self.efficiency.converged():
+            return False
+        print("EventPipeline::run: target relative error " + str(self.efficiency.targetRelativeError) +
+              " of PID efficiencies reached after " + str(eventsDone) + " events")
+        self.plotHist.nEvents = eventsDone
+        return True
+
+    def generate(self, start):
+        for i in range(start, self.nEvents):
+            startTime = self.monitor.now()
+            evt = self.gen.generateEvent()
+            self.monitor.stop("generation", startTime)
+            yield evt
+
+    def reconstruct(self, events):
+        for evt in events:
+            startTime = self.monitor.now()
+            self.reco.reconstructEvent(evt)
+            self.monitor.stop("reconstruction", startTime)
+            yield evt
+
+    def classify(self, events):
+        for evt in events:
+            startTime = self.monitor.now()
+            classification = self.pidSelector.classifyEvent(evt)
+            if self.efficiency is not None:
+                self.efficiency.addEvent(evt.pairID, classification[1], evt.weight)
+            self.monitor.stop("pid", startTime)
+            yield evt, classification
+
+    def fill(self, classifiedEvents):
+        for (evt, classification) in classifiedEvents:
+            startTime = self.monitor.now()
+            self.plotHist.fillClassifiedEvent(evt, classification)
+            self.monitor.stop("filling", startTime)
+            yield evt
+
+    def store(self, events):
+        for evt in events:
+            startTime = self.monitor.now()
+            self.eventStore.append(evt)
+            self.monitor.stop("storage", startTime)
+            yield evt
+
+    def generateBatches(self, start):
+        while start < self.nEvents:
+            nEvents = min(self.batchSize, self.nEvents - start)
+            startTime = self.monitor.now()
+            batch = self.gen.generateBatch(nEvents)
+            self.monitor.stop("generation", startTime)
+            yield batch
+            start += nEvents
+
+    def reconstructBatches(self, batches):
+        for batch in batches:
+            startTime = self.monitor.now()
+            self.reco.reconstructBatch(batch)
+            self.monitor.stop("reconstruction", startTime)
+            yield batch
+
+    def classifyBatches(self, batches):
+        for batch in batches:
+            startTime = self.monitor.now()
+            classification = self.pidSelector.classify(batch.nSigma, batch.mSquared)
+            if self.efficiency is not None:
+                self.efficiency.add(batch.pairID, classification[1], batch.weight)
+            self.monitor.stop("pid", startTime)
+            yield batch, classification
+
+    # fills the histograms (see PlottingHistograms.fillClassifiedBatch)
+    def fillBatches(self, classifiedBatches):
+        for (batch, classification) in classifiedBatches:
+            startTime = self.monitor.now()
+            self.plotHist.fillClassifiedBatch(batch, classification)
+            self.monitor.stop("filling", startTime)
+            yield batch
+
+    def storeBatches(self, batches):
+        for batch in batches:
+            startTime = self.monitor.now()
+            self.eventStore.appendBatch(batch)
+            self.monitor.stop("storage", startTime)
+            yield batch
+
+    # writes the state of the run after eventsDone events; the file is written
+    # under temporary name and renamed, so a crash never leaves it incomplete
+    def checkpoint(self, eventsDone):
+        startTime = self.monitor.now()
+        temporaryFile = self.checkpointFile + ".tmp"
+        directory = ROOT.gDirectory.GetDirectory("")
+        checkpoint = ROOT.TFile.Open(temporaryFile, "RECREATE")
+        for histogram in self.plotHist.getHistograms():
+            checkpoint.WriteObject(histogram, histogram.GetName())
+        state = {"eventsDone": eventsDone, "nEvents": self.nEvents, "generator": self.gen.getState(),
+                 "reconstruction": self.reco.random.getState()}
+        if self.efficiency is not None:
+            state["efficiency"] = self.efficiency.getState()
+        if self.eventStore is not None:
+            self.eventStore.flush()
+            state["eventStoreChunks"] = len(self.eventStore.chunkSizes)
+        ROOT.TNamed("state", json.dumps(state)).Write()
+        checkpoint.Close()
+        directory.cd()
+        os.rename(temporaryFile, self.checkpointFile)
+        self.monitor.stop("checkpoint", startTime)
+
+    # restores the state of the run from the checkpoint file and returns
+    # the number of events already processed (0 if there is no usable checkpoint)
+    def restore(self):
+        if not os.path.exists(self.checkpointFile):
+            return 0
+        directory = ROOT.gDirectory.GetDirectory("")
+        checkpoint = ROOT.TFile.Open(self.checkpointFile, "READ")
+        state = json.loads(checkpoint.Get("state").GetTitle())
+        if state["nEvents"] != self.nEvents or "reconstruction" not in state:
+            print("EventPipeline::restore: checkpoint " + self.checkpointFile + " belongs to a run of " +
+                  str(state["nEvents"]) + " events or an older version, starting from scratch")
+            checkpoint.Close()
+            directory.cd()
+            return 0
+        for histogram in self.plotHist.getHistograms():
+            histogram.Reset()
+            histogram.Add(checkpoint.Get(histogram.GetName()))
+        self.reco.random.setState(state["reconstruction"])
+        self.gen.setState(state["generator"])
+        if self.efficiency is not None and "efficiency" in state:
+            self.efficiency.setState(state["efficiency"])
+        if self.eventStore is not None:
+            self.eventStore.truncate(state.get("eventStoreChunks", 0))
+        checkpoint.Close()
+        directory.cd()
+        print("EventPipeline::restore: resuming after " + str(state["eventsDone"]) + " events")
+        return state["eventsDone"]
@@ -1,16 +1,23 @@
 # Class reconstructing DST variables
 
 import ROOT
+import numpy
 from ParticleId import *
 from ExclusiveEvent import *
+from SquaredMassSolver import *
+from dEdxExpectation import *
+from RandomNumberService import *
 
 
 class EventReconstruction:
-    # constructor
-    def __init__(self, dEdxEngine):
+    # constructor; seed initialises the random number streams (0 means seeding from the system
+    # entropy) unless a RandomNumberService random is given, expectation is the dEdxExpectation
+    # of dEdxEngine (random and expectation can be shared with the EventGenerator)
+    def __init__(self, dEdxEngine, seed=0, expectation=None, random=None):
         self.c = 29.9792  # cm/ns
         self.dEdxEngine = dEdxEngine
-        self.randomNumGen = ROOT.TRandom3(0)
+        self.dEdxExpectation = expectation if expectation is not None else dEdxExpectation(dEdxEngine)
+        self.random = random if random is not None else RandomNumberService(seed)
         self.tofResolution = 0.1  # ns
         self.momentumResolution = 0.02  # %
 
@@ -23,49 +30,59 @@ class EventReconstruction:
         self.getTofTime(evt)
         self.getSquaredMass(evt)
 
+    # columnar counterpart of reconstructEvent: takes a batch of events
+    # stored as arrays (EventBatch) and fills its reconstructed columns.
+    # Random numbers are drawn in the same order as by consecutive calls
+    # of reconstructEvent, so both paths agree for the same random streams
+    def reconstructBatch(self, batch):
+        nEvents = len(batch.pairID)
+        self.getNSigmaBatch(batch)
+        self.getTofPathLengthBatch(batch)
+        self.getTofTimeBatch(batch, self.random.normal("tofTime", size=(nEvents, 2)))
+        self.getSquaredMassBatch(batch, self.random.normal("momentumSmearing", size=(nEvents, 2)))
+
     # calculates nSigma variables accordind to Bichsel parametrisation
     # of dE/dx(p) for three PID assumptions: pi, K and p
     def getNSigma(self, evt):
-        for i in range(2):
-            for j in range(len(ParticleId.mass)):
-                pOverM = evt.p[i]/ParticleId.mass[j]
-                evt.nSigma[i][j] = ROOT.TMath.Log(evt.dEdx[i]/(1e-6*ROOT.TMath.Exp(self.dEdxEngine.GetMostProbableZ(
-                                   ROOT.TMath.Log10(pOverM), 1.))))/(self.dEdxEngine.GetRmsZ(
-                                   ROOT.TMath.Log10(pOverM), 1.)/7)
+        evt.nSigma = self.dEdxExpectation.nSigma(evt.dEdx, evt.p)
 
-    # calculates length of a path that particle has followed from the vertex
-    # to the TOF module
+    def getNSigmaBatch(self, batch):
+        batch.nSigma[:] = self.dEdxExpectation.nSigma(batch.dEdx, batch.p)
+
+    # takes length of a path that particle has followed from the vertex
+    # to the TOF module from the tracking (exact helix or stepped path length)
     def getTofPathLength(self, evt):
-        for i in range(2):
-            xdif = evt.ToFhitPosition[i].x() - evt.vrt.x()
-            ydif = evt.ToFhitPosition[i].y() - evt.vrt.y()
-            C = ROOT.TMath.Sqrt(xdif * xdif + ydif * ydif)
-            s_perp = 2 * evt.R[i] * ROOT.TMath.ASin(C / (2 * evt.R[i]))
-            s_z = abs(evt.ToFhitPosition[i].z() - evt.vrt.z())
-            evt.trkLength[i] = ROOT.TMath.Sqrt(s_perp * s_perp + s_z * s_z)
+        evt.trkLength = evt.pathLength
+
+    def getTofPathLengthBatch(self, batch):
+        batch.trkLength[:] = batch.pathLength
 
     # calculates time of detection in the TOF module (accounts for resolution)
     def getTofTime(self, evt):
         for i in range(2):
             pOverM = evt.p[i] / ParticleId.mass[evt.pairID]
             evt.tofTime[i] = evt.trkLength[i] * ROOT.TMath.Sqrt(1./(pOverM * pOverM) + 1) / self.c +\
-                             self.randomNumGen.Gaus(0, self.tofResolution)
+                             self.random.normal("tofTime", 0, self.tofResolution)
+
+    # gaus holds standard normal numbers of shape (nEvents, 2)
+    def getTofTimeBatch(self, batch, gaus):
+        pOverM = batch.p / numpy.asarray(ParticleId.mass)[batch.pairID][:, numpy.newaxis]
+        batch.tofTime[:] = batch.trkLength * numpy.sqrt(1./(pOverM * pOverM) + 1) / self.c + self.tofResolution * gaus
 
     # calculates squared mass assuming equal masses of two particles,
     # making use of tracks momenta, lengths and times of detection in TOF
-    # (accounts for resolution effects)
+    # (accounts for resolution effects); see SquaredMassSolver
     def getSquaredMass(self, evt):
-        LSq = []
         PSq = []
         for i in range(2):
-            LSq.append(evt.trkLength[i]*evt.trkLength[i] / (self.c*self.c))
-            momentumSmearing = self.randomNumGen.Gaus(1.0, self.momentumResolution)
+            momentumSmearing = self.random.normal("momentumSmearing", 1.0, self.momentumResolution)
             PSq.append(momentumSmearing * momentumSmearing * evt.p[i] * evt.p[i])
-        dtHitSq = (evt.tofTime[0] - evt.tofTime[1]) * (evt.tofTime[0] - evt.tofTime[1])
-        aEq = -2 * LSq[0] * LSq[1] / (PSq[0] * PSq[1]) + LSq[0] * LSq[0] / (PSq[0] * PSq[0]) +\
-              LSq[1] * LSq[1] / (PSq[1] * PSq[1])
-        bEq = -2 * LSq[0] * LSq[1] * (1 / PSq[0] + 1 / PSq[1]) + 2 * LSq[0] * LSq[0] / PSq[0] +\
-              2 * LSq[1] * LSq[1] / PSq[1] - 2 * dtHitSq * (LSq[0] / PSq[0] + LSq[1] / PSq[1])
-        cEq = dtHitSq * dtHitSq - 2 * dtHitSq * (LSq[0] + LSq[1]) +\
-              LSq[0] * LSq[0] + LSq[1] * LSq[1] - 2 * LSq[0] * LSq[1]
-        evt.mSquared = (-bEq + ROOT.TMath.Sqrt(bEq * bEq - 4 * aEq * cEq)) / (2 * aEq)
+        (mSquared, status) = SquaredMassSolver.solve(evt.trkLength, evt.tofTime, PSq)
+        evt.mSquared = mSquared
+        evt.mSquaredStatus = status
+
+    # gaus holds standard normal numbers of shape (nEvents, 2)
+    def getSquaredMassBatch(self, batch, gaus):
+        momentumSmearing = 1.0 + self.momentumResolution * gaus
+        PSq = momentumSmearing * momentumSmearing * batch.p * batch.p
+        (batch.mSquared[:], batch.mSquaredStatus[:]) = SquaredMassSolver.solve(batch.trkLength, batch.tofTime, PSq)
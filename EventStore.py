@@ -0,0 +1,122 @@
+# Class storing generated and reconstructed quantities of events in a
+# columnar format: a directory with compressed numpy chunks (one .npz file
+# per chunk of events, one array per column) and a meta.json file.
+# Stored events can be read back chunk by chunk as EventBatch objects,
+# e.g. to replay the analysis without simulating the events again
+
+from EventBatch import *
+import json
+import os
+import numpy
+
+
+class EventStore:
+    columns = ("pairID", "vrt", "p", "dEdx", "trkLength", "tofTime", "nSigma", "mSquared", "mSquaredStatus", "weight")
+
+    # mode is "w" (new store), "a" (append to existing store) or "r" (read)
+    def __init__(self, directory, mode="r", chunkSize=100000):
+        assert mode in ("w", "a", "r")
+        self.directory = directory
+        self.mode = mode
+        self.chunkSize = chunkSize
+        self.buffer = None
+        self.nBuffered = 0
+        if mode == "w" and os.path.exists(directory):
+            for fileName in os.listdir(directory):
+                if fileName.startswith("chunk_") or fileName == "meta.json":
+                    os.remove(os.path.join(directory, fileName))
+        if mode != "r" and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.chunkSizes = []
+        if mode != "w" and os.path.exists(os.path.join(directory, "meta.json")):
+            self.chunkSizes = self.readMeta()["chunkSizes"]
+
+    def readMeta(self):
+        with open(os.path.join(self.directory, "meta.json")) as metaFile:
+            return json.load(metaFile)
+
+    def writeMeta(self):
+        temporaryFile = os.path.join(self.directory, "meta.json.tmp")
+        with open(temporaryFile, "w") as metaFile:
+            json.dump({"columns": list(self.columns), "chunkSizes": self.chunkSizes}, metaFile)
+        os.rename(temporaryFile, os.path.join(self.directory, "meta.json"))
+
+    def chunkFile(self, index):
+        return os.path.join(self.directory, "chunk_" + format(index, "06d") + ".npz")
+
+    # number of stored events (including those not flushed yet)
+    def __len__(self):
+        return sum(self.chunkSizes) + self.nBuffered
+
+    # adds single event (ExclusiveEvent)
+    def append(self, evt):
+        if self.buffer is None:
+            self.buffer = EventBatch(self.chunkSize)
+        row = self.nBuffered
+        for column in self.columns:
+            getattr(self.buffer, column)[row] = getattr(evt, column)
+        self.nBuffered += 1
+        if self.nBuffered == self.chunkSize:
+            self.flush()
+
+    # adds batch of events (EventBatch)
+    def appendBatch(self, batch):
+        self.flush()
+        for start in range(0, len(batch.pairID), self.chunkSize):
+            stop = min(start + self.chunkSize, len(batch.pairID))
+            self.writeChunk(dict([(column, getattr(batch, column)[start:stop]) for column in self.columns]))
+
+    # writes buffered events as a new chunk
+    def flush(self):
+        if self.nBuffered == 0:
+            return
+        self.writeChunk(dict([(column, getattr(self.buffer, column)[:self.nBuffered]) for column in self.columns]))
+        self.nBuffered = 0
+
+    def writeChunk(self, arrays):
+        numpy.savez_compressed(self.chunkFile(len(self.chunkSizes)), **arrays)
+        self.chunkSizes.append(len(arrays["pairID"]))
+        self.writeMeta()
+
+    # removes chunks beyond the first nChunks (used when resuming an interrupted run)
+    def truncate(self, nChunks):
+        self.buffer = None
+        self.nBuffered = 0
+        for index in range(nChunks, len(self.chunkSizes)):
+            if os.path.exists(self.chunkFile(index)):
+                os.remove(self.chunkFile(index))
+        self.chunkSizes = self.chunkSizes[:nChunks]
+        self.writeMeta()
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+            self.writeMeta()
+
+    # yields stored events chunk by chunk as EventBatch objects
+    # (only the stored columns are filled)
+    def chunks(self):
+        for index, size in enumerate(self.chunkSizes):
+            batch = EventBatch(size)
+            with numpy.load(self.chunkFile(index)) as arrays:
+                for column in self.columns:
+                    # stores written before a column was added lack it (weights stay 1)
+                    if column in arrays:
+                        getattr(batch, column)[:] = arrays[column]
+            yield batch
+
+    # replays the analysis on stored events, filling histograms of plotHist
+    def replay(self, plotHist):
+        for batch in self.chunks():
+            plotHist.fillBatch(batch)
+
+
+if __name__ == '__main__':
+    import sys
+    from PlottingHistograms import *
+    store = EventStore(sys.argv[1])
+    plotHist = PlottingHistograms(len(store))
+    store.replay(plotHist)
+    plotHist.writeHistograms()
+    from PlotRenderer import PlotRenderer
+    PlotRenderer().render()
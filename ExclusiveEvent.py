@@ -1,21 +1,80 @@
-# Class representing 2-particle exclusive event
+# Class representing 2-particle exclusive event. Event data are kept in one
+# record of a numpy structured array with layout ExclusiveEvent.dtype and
+# the attributes are views into that record (assigning to an attribute
+# copies the values into the record), so events allocated by an
+# ExclusiveEventPool share one preallocated array. pathLength is the path
+# length of the tracks to the TOF given by the tracking, weight is the event
+# weight of importance-weighted generation (1 for unweighted events)
 
 from ParticleId import *
 import numpy
-import ROOT
 
-class ExclusiveEvent:
-    def __init__(self, pid, vertex):
+
+# returns property giving access to a field of the event record
+def recordField(name):
+    def get(self):
+        return self.record[name]
+
+    def set(self, value):
+        self.record[name] = value
+    return property(get, set)
+
+
+class ExclusiveEvent(object):
+    dtype = numpy.dtype([("pairID", int),
+                         ("vrt", float, 3),
+                         ("p", float, 2),
+                         ("dEdx", float, 2),
+                         ("trkLength", float, 2),
+                         ("R", float, 2),
+                         ("pathLength", float, 2),
+                         ("tofTime", float, 2),
+                         ("nSigma", float, (2, len(ParticleId.mass))),
+                         ("ToFhitPosition", float, (2, 3)),
+                         ("mSquared", float),
+                         ("mSquaredStatus", numpy.int8),
+                         ("weight", float)])
+    charge = (1, -1)
+    __slots__ = ("record",)
+
+    # vertex is a sequence (x, y, z) or ROOT.TVector3; record is the element of
+    # an array with layout ExclusiveEvent.dtype to keep the data in (by default
+    # a new one is allocated)
+    def __init__(self, pid, vertex, record=None):
         assert(isinstance(pid, int))
-        assert(isinstance(vertex, ROOT.TVector3))
-        self.pairID = pid
-        self.vrt = vertex
-        self.charge = (1, -1)
-        self.p = numpy.empty(2, dtype=float)
-        self.dEdx = numpy.empty(2, dtype=float)
-        self.trkLength = numpy.empty(2, dtype=float)
-        self.R = numpy.empty(2, dtype=float)
-        self.tofTime = numpy.empty(2, dtype=float)
-        self.nSigma = numpy.empty([2, len(ParticleId.mass)], dtype=float)
-        self.ToFhitPosition = []
-        self.mSquared = numpy.empty(2, dtype=float)
+        if record is None:
+            record = numpy.zeros(1, dtype=self.dtype)[0]
+            record["weight"] = 1.
+        self.record = record
+        self.reset(pid, vertex)
+
+    # sets event type and vertex, used when the record is reused for a new event
+    def reset(self, pid, vertex):
+        if hasattr(vertex, "X"):
+            vertex = (vertex.X(), vertex.Y(), vertex.Z())
+        self.record["pairID"] = pid
+        self.record["vrt"] = vertex
+
+
+for name in ExclusiveEvent.dtype.names:
+    setattr(ExclusiveEvent, name, recordField(name))
+
+
+# Class allocating ExclusiveEvent objects from one preallocated structured
+# array. Records (and event objects) are reused in a ring, so an event stays
+# valid until capacity further events have been allocated
+class ExclusiveEventPool:
+    def __init__(self, capacity=1024):
+        self.data = numpy.zeros(capacity, dtype=ExclusiveEvent.dtype)
+        self.data["weight"] = 1.
+        self.events = [None] * capacity
+        self.next = 0
+
+    def allocate(self, pid, vertex):
+        index = self.next
+        self.next = (index + 1) % len(self.events)
+        if self.events[index] is None:
+            self.events[index] = ExclusiveEvent(pid, vertex, self.data[index])
+        else:
+            self.events[index].reset(pid, vertex)
+        return self.events[index]
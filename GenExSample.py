@@ -0,0 +1,113 @@
+# Class giving access to the GenEx Monte Carlo sample of exclusive pairs
+# of given particle type. The GenEx text output is converted once into
+# a binary columnar file (float64 columns px, py, pz of both tracks and
+# the 7th GenEx column), which is then memory-mapped. Pairs can be read
+# sequentially or drawn at random; the policy decides what happens when
+# the sequential reading reaches the end of the sample: "wrap" starts
+# again from the beginning, "resample" draws random pairs (with
+# replacement) and "stop" raises EOFError. A selection of pairs (e.g.
+# those within the detector acceptance) can be set, after which only the
+# selected pairs are read
+
+from ParticleId import *
+import os
+import numpy
+
+
+class GenExSample:
+    columns = ("px1", "py1", "pz1", "px2", "py2", "pz2", "column7")
+
+    def __init__(self, pid, randomNumGen, policy="wrap", directory="GenEx"):
+        assert policy in ("wrap", "resample", "stop")
+        self.pid = pid
+        self.randomNumGen = randomNumGen
+        self.policy = policy
+        self.textFile = os.path.join(directory, ParticleId.name[pid] + ".dat")
+        self.binaryFile = os.path.join(directory, ParticleId.name[pid] + ".npy")
+        self.convert()
+        self.data = numpy.load(self.binaryFile, mmap_mode="r")
+        self.selection = None
+        self.acceptanceFraction = 1.
+        self.cursor = 0
+        self.nPasses = 0
+
+    # converts the GenEx text file into the binary format, unless the binary
+    # file is already there and newer than the text one
+    def convert(self):
+        if os.path.exists(self.binaryFile) and os.path.getmtime(self.binaryFile) >= os.path.getmtime(self.textFile):
+            return
+        data = numpy.loadtxt(self.textFile, ndmin=2)
+        if data.shape[1] != len(self.columns):
+            raise ValueError("GenExSample::convert: " + self.textFile + " has " + str(data.shape[1]) +
+                             " columns, expected " + str(len(self.columns)))
+        temporaryFile = self.binaryFile + ".tmp" + str(os.getpid()) + ".npy"
+        numpy.save(temporaryFile, numpy.ascontiguousarray(data.T))
+        os.rename(temporaryFile, self.binaryFile)
+
+    # number of pairs in the whole sample (regardless of the selection)
+    def nPairs(self):
+        return self.data.shape[1]
+
+    # number of pairs available for reading
+    def __len__(self):
+        return self.data.shape[1] if self.selection is None else len(self.selection)
+
+    # restricts reading to the pairs for which mask (array of nPairs() flags)
+    # is True; acceptanceFraction is set to the fraction of selected pairs
+    def setSelection(self, mask):
+        self.selection = numpy.flatnonzero(mask)
+        if len(self.selection) == 0:
+            raise ValueError("GenExSample::setSelection: no pair of " + self.textFile + " selected")
+        self.acceptanceFraction = float(len(self.selection)) / self.nPairs()
+        self.cursor = 0
+        self.nPasses = 0
+
+    # returns next pair of the sample as array of GenExSample.columns values
+    def next(self):
+        return self.nextBlock(1)[0]
+
+    # returns next nPairs pairs, shape (nPairs, 7)
+    def nextBlock(self, nPairs):
+        return self.rows(self.nextIndices(nPairs))
+
+    # returns nPairs pairs drawn at random (with replacement), shape (nPairs, 7)
+    def sample(self, nPairs):
+        return self.rows(self.randomNumGen.integers(0, len(self), size=nPairs))
+
+    # returns pairs with given indices (counted among the selected pairs), shape (len(indices), 7)
+    def rows(self, indices):
+        if self.selection is not None:
+            indices = self.selection[indices]
+        return self.data[:, indices].T
+
+    # returns all pairs of the sample (regardless of the selection), shape (nPairs(), 7)
+    def allRows(self):
+        return self.data.T
+
+    # returns indices of next nPairs pairs read sequentially, applying the policy
+    # if the end of the sample is reached
+    def nextIndices(self, nPairs):
+        size = len(self)
+        if self.cursor + nPairs <= size:
+            indices = numpy.arange(self.cursor, self.cursor + nPairs)
+            self.cursor += nPairs
+            return indices
+        if self.policy == "stop":
+            raise EOFError("GenExSample::nextIndices: GenEx sample " + self.textFile + " exhausted")
+        if self.policy == "resample":
+            indices = numpy.concatenate([numpy.arange(self.cursor, size),
+                                         self.randomNumGen.integers(0, size, size=self.cursor + nPairs - size)])
+            self.cursor = size
+            return indices
+        indices = numpy.arange(self.cursor, self.cursor + nPairs)
+        self.nPasses += (self.cursor + nPairs) // size
+        self.cursor = (self.cursor + nPairs) % size
+        return indices % size
+
+    # returns the position of the sequential reading
+    def tell(self):
+        return self.cursor
+
+    # sets the position of the sequential reading
+    def seek(self, cursor):
+        self.cursor = cursor
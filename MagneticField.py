@@ -0,0 +1,112 @@
+# Class describing the magnetic field of the STAR solenoid: either uniform
+# longitudinal field, or axially symmetric map given on a regular (r, z) grid.
+# Map files are text files with columns r [cm], z [cm], Br [T], Bz [T] (lines
+# starting with # are skipped); the grid is converted once to a .npz file next
+# to the text file and read from it afterwards. Between the grid nodes the
+# field is interpolated bilinearly, outside the grid the nearest edge is used
+
+import os
+import numpy
+
+
+class MagneticField:
+    columns = ("r", "z", "Br", "Bz")
+
+    # uniform field Bz [T] (r, z, BrMap, BzMap not given), or map with
+    # field components BrMap, BzMap [T] of shape (len(r), len(z)) on regular grid r, z [cm]
+    def __init__(self, Bz=0.5, r=None, z=None, BrMap=None, BzMap=None):
+        self.Bz = Bz
+        self.uniform = BzMap is None
+        if self.uniform:
+            return
+        self.r = numpy.asarray(r, dtype=float)
+        self.z = numpy.asarray(z, dtype=float)
+        self.BrMap = numpy.ascontiguousarray(BrMap, dtype=float)
+        self.BzMap = numpy.ascontiguousarray(BzMap, dtype=float)
+        self.rMin = float(self.r[0])
+        self.zMin = float(self.z[0])
+        self.rStep = float(self.r[-1] - self.r[0]) / (len(self.r) - 1)
+        self.zStep = float(self.z[-1] - self.z[0]) / (len(self.z) - 1)
+        # flat copies for the scalar lookup in at()
+        self.BrList = self.BrMap.ravel().tolist()
+        self.BzList = self.BzMap.ravel().tolist()
+        self.Bz = float(self.evaluate(0., 0., 0.)[2])
+
+    # reads field map from the text file (through its .npz cache)
+    @staticmethod
+    def fromFile(fileName):
+        binaryFile = os.path.splitext(fileName)[0] + ".npz"
+        if not os.path.exists(binaryFile) or os.path.getmtime(binaryFile) < os.path.getmtime(fileName):
+            MagneticField.convert(fileName, binaryFile)
+        with numpy.load(binaryFile) as grid:
+            return MagneticField(r=grid["r"], z=grid["z"], BrMap=grid["BrMap"], BzMap=grid["BzMap"])
+
+    # converts text field map to the grid stored in binaryFile
+    @staticmethod
+    def convert(fileName, binaryFile):
+        data = numpy.loadtxt(fileName, ndmin=2)
+        if data.shape[1] != len(MagneticField.columns):
+            raise ValueError("MagneticField::convert: " + fileName + " has " + str(data.shape[1]) +
+                             " columns, expected " + str(len(MagneticField.columns)))
+        r = numpy.unique(data[:, 0])
+        z = numpy.unique(data[:, 1])
+        if len(r) < 2 or len(z) < 2 or len(data) != len(r) * len(z) or\
+                not numpy.allclose(numpy.diff(r), r[1] - r[0]) or not numpy.allclose(numpy.diff(z), z[1] - z[0]):
+            raise ValueError("MagneticField::convert: " + fileName + " is not a regular (r, z) grid")
+        BrMap = numpy.empty((len(r), len(z)))
+        BzMap = numpy.empty((len(r), len(z)))
+        i = numpy.searchsorted(r, data[:, 0])
+        j = numpy.searchsorted(z, data[:, 1])
+        BrMap[i, j] = data[:, 2]
+        BzMap[i, j] = data[:, 3]
+        temporaryFile = binaryFile + ".tmp.npz"
+        numpy.savez(temporaryFile, r=r, z=z, BrMap=BrMap, BzMap=BzMap)
+        os.rename(temporaryFile, binaryFile)
+
+    def isUniform(self):
+        return self.uniform
+
+    # longitudinal field at the centre of the detector [T], e.g. for helix radius estimates
+    def nominal(self):
+        return self.Bz
+
+    # returns field (Bx, By, Bz) [T] at single point (x, y, z) [cm] as floats
+    def at(self, x, y, z):
+        if self.uniform:
+            return (0., 0., self.Bz)
+        r = (x * x + y * y) ** 0.5
+        fr = min(max((r - self.rMin) / self.rStep, 0.), len(self.r) - 1.)
+        fz = min(max((z - self.zMin) / self.zStep, 0.), len(self.z) - 1.)
+        i = min(int(fr), len(self.r) - 2)
+        j = min(int(fz), len(self.z) - 2)
+        (tr, tz) = (fr - i, fz - j)
+        nz = len(self.z)
+        (c00, c01, c10, c11) = (i * nz + j, i * nz + j + 1, (i + 1) * nz + j, (i + 1) * nz + j + 1)
+        (w00, w01, w10, w11) = ((1 - tr) * (1 - tz), (1 - tr) * tz, tr * (1 - tz), tr * tz)
+        Br = w00 * self.BrList[c00] + w01 * self.BrList[c01] + w10 * self.BrList[c10] + w11 * self.BrList[c11]
+        Bz = w00 * self.BzList[c00] + w01 * self.BzList[c01] + w10 * self.BzList[c10] + w11 * self.BzList[c11]
+        if r == 0:
+            return (0., 0., Bz)
+        return (Br * x / r, Br * y / r, Bz)
+
+    # returns field components (Bx, By, Bz) [T] at points (x, y, z) [cm] given as arrays
+    def evaluate(self, x, y, z):
+        (x, y, z) = numpy.broadcast_arrays(numpy.asarray(x, dtype=float), numpy.asarray(y, dtype=float),
+                                           numpy.asarray(z, dtype=float))
+        if self.uniform:
+            return (numpy.zeros(x.shape), numpy.zeros(x.shape), numpy.full(x.shape, self.Bz))
+        r = numpy.hypot(x, y)
+        fr = numpy.clip((r - self.rMin) / self.rStep, 0, len(self.r) - 1)
+        fz = numpy.clip((z - self.zMin) / self.zStep, 0, len(self.z) - 1)
+        i = numpy.minimum(fr.astype(int), len(self.r) - 2)
+        j = numpy.minimum(fz.astype(int), len(self.z) - 2)
+        (tr, tz) = (fr - i, fz - j)
+        components = []
+        for fieldMap in (self.BrMap, self.BzMap):
+            components.append((1 - tr) * (1 - tz) * fieldMap[i, j] + (1 - tr) * tz * fieldMap[i, j + 1] +
+                              tr * (1 - tz) * fieldMap[i + 1, j] + tr * tz * fieldMap[i + 1, j + 1])
+        (Br, Bz) = components
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            cosPhi = numpy.where(r > 0, x / r, 0.)
+            sinPhi = numpy.where(r > 0, y / r, 0.)
+        return (Br * cosPhi, Br * sinPhi, Bz)
@@ -1,59 +1,56 @@
 # Main file of the simulation
 
-import ROOT
 from EventGenerator import *
 from EventReconstruction import *
 from PlottingHistograms import *
+from EventPipeline import *
+from EventStore import *
+from RunMonitor import *
+from RandomNumberService import *
+from PidEfficiency import *
 from numpy import *
 
 
 # number of events to simulate
 nEvents = 2e2
-
-gen = EventGenerator()
-reco = EventReconstruction(gen.dEdxEngine)
+# number of events between checkpoints (an interrupted run is resumed from the last one)
+checkpointInterval = 10000
+# number of events processed at once with vectorised generation, reconstruction
+# and bulk histogram filling (None: events are processed one by one)
+batchSize = 10000
+# seconds between progress reports, profiling of the run with cProfile
+# (statistics in Output/runProfile.prof), summary in Output/runSummary.json
+reportInterval = 10.
+profile = False
+# directory to store reconstructed events in (None: events are not stored),
+# stored events can be replayed with "python EventStore.py <directory>"
+eventStoreDir = None
+
+# seed of the random number streams (0: seeding from the system entropy)
+seed = 0
+# the run stops before nEvents when relative errors of the PID efficiencies
+# of all generated species fall below this value (None: nEvents are simulated)
+targetRelativeError = None
+# importance-weighted generation: factors oversampling the species (pion, kaon,
+# proton) and, per species, bins of the pair invariant mass, e.g.
+# {ParticleId.PROTON: ([2., 2.5, 3.2], [5., 20.])}; events carry weights
+# restoring the unbiased distributions (None: unweighted generation)
+speciesBias = None
+massBias = None
+
+randomNumbers = RandomNumberService(seed)
+gen = EventGenerator(random=randomNumbers, speciesBias=speciesBias, massBias=massBias)
+reco = EventReconstruction(gen.dEdxEngine, expectation=gen.dEdxExpectation, random=randomNumbers)
 plotHist = PlottingHistograms(nEvents)
 
 # main loop
-for i in range(0, int(nEvents)):
-    print i
-    evt = gen.generateEvent()
-    reco.reconstructEvent(evt)
-    plotHist.h2dEdxVsMomentum.Fill(-evt.p[0], evt.dEdx[0])
-    plotHist.h2dEdxVsMomentum.Fill(evt.p[1], evt.dEdx[1])
-    squaredMass = evt.mSquared
-    plotHist.mhSqMassTof.Fill(squaredMass)
-    nParticles = 3
-    nSigmaVal = zeros((2, 3), float)
-    sqRootNSigma = []
-    for w in range(0, nParticles):
-        for j in range(0, 2):
-            nSigmaVal[j][w] = evt.nSigma[j][w]
-            plotHist.hNSigma[w].Fill(nSigmaVal[j][w])
-        sqRootNSigma.append(ROOT.TMath.Sqrt(nSigmaVal[0][w]*nSigmaVal[0][w] + nSigmaVal[1][w]*nSigmaVal[1][w]))
-
-    #determine the PID of pair
-    pidReco = nParticles
-    if sqRootNSigma[ParticleId.PION]>3 and sqRootNSigma[ParticleId.KAON]>3 and sqRootNSigma[ParticleId.PROTON]<3 and squaredMass > 0.7 and squaredMass < 1.1:
-        pidReco = ParticleId.PROTON
-    elif sqRootNSigma[ParticleId.PION]>3 and sqRootNSigma[ParticleId.KAON]<3 and sqRootNSigma[ParticleId.PROTON]>3 and squaredMass > 0.2 and squaredMass < 0.32:
-        pidReco = ParticleId.KAON
-    elif nSigmaVal[0][ParticleId.PION]<3 and nSigmaVal[1][ParticleId.PION]<3:
-        pidReco = ParticleId.PION
-
-    if sqRootNSigma[ParticleId.PION]>3 and sqRootNSigma[ParticleId.KAON]>3 and sqRootNSigma[ParticleId.PROTON]<3:
-        plotHist.mhSqMassTofPid[ParticleId.PROTON].Fill( squaredMass )
-    elif sqRootNSigma[ParticleId.PION]>3 and sqRootNSigma[ParticleId.KAON]<3 and sqRootNSigma[ParticleId.PROTON]>3:
-        plotHist.mhSqMassTofPid[ParticleId.KAON].Fill(squaredMass)
-    elif pidReco == ParticleId.PION:
-        plotHist.mhSqMassTofPid[ParticleId.PION].Fill(squaredMass)
-
-    for j in range(0, nParticles):
-        plotHist.mhSqMassTofVsSqRootNSigma[j].Fill(sqRootNSigma[j], squaredMass)
-    plotHist.mhSqRootNSigmaPionVsKaon.Fill(sqRootNSigma[ParticleId.KAON], sqRootNSigma[ParticleId.PION])
-    plotHist.mhSqRootNSigmaPionVsProton.Fill(sqRootNSigma[ParticleId.PROTON], sqRootNSigma[ParticleId.PION])
-    plotHist.mhSqRootNSigmaKaonVsProton.Fill(sqRootNSigma[ParticleId.PROTON], sqRootNSigma[ParticleId.KAON])
-    plotHist.hPidRecoVsPidGenerated.Fill(evt.pairID, pidReco)
-
-# print histograms in the Output directory
-plotHist.plotHistograms()
+eventStore = EventStore(eventStoreDir, "a") if eventStoreDir is not None else None
+monitor = RunMonitor(nEvents, reportInterval, profiler=profile or None)
+efficiency = PidEfficiency(targetRelativeError,
+                           species=[pid for pid in range(len(ParticleId.name)) if gen.particleProbabilities[pid] > 0])
+EventPipeline(gen, reco, plotHist, nEvents, checkpointInterval, eventStore=eventStore,
+              batchSize=batchSize, monitor=monitor, efficiency=efficiency).run()
+
+# write histograms to Output/analysisOutput.root, plots are rendered
+# from it with "python PlotRenderer.py"
+plotHist.writeHistograms()
@@ -0,0 +1,151 @@
+# Class accumulating the matrix of counts of generated (pairID) vs.
+# reconstructed (pidReco) pair species while the simulation runs, from which
+# PID efficiency (fraction of generated pairs of a species identified
+# correctly) and purity (fraction of pairs identified as a species which
+# are of that species) are computed with Wilson score or normal
+# approximation (binomial) uncertainties. Events can be weighted: sums of
+# weights and of squared weights are accumulated and the uncertainties are
+# those of the effective number of events (sum w)^2 / sum w^2. With
+# targetRelativeError set, converged() tells when all efficiencies (and
+# optionally purities) of the given species are known to that relative
+# precision, so the run can stop
+
+from ParticleId import *
+from PidSelector import *
+import numpy
+
+
+class PidEfficiency:
+    # targetRelativeError (e.g. 0.005; None: never converged), species whose
+    # efficiencies enter the stop condition (default: all), purity=True adds
+    # their purities to it, z is the number of standard deviations of the
+    # intervals, method is "wilson" or "binomial"; no stop before minEvents
+    def __init__(self, targetRelativeError=None, species=None, purity=False, z=1., method="wilson", minEvents=1000):
+        assert method in ("wilson", "binomial")
+        self.targetRelativeError = targetRelativeError
+        self.species = list(species) if species is not None else list(range(len(ParticleId.mass)))
+        self.purity = purity
+        self.z = z
+        self.method = method
+        self.minEvents = minEvents
+        # rows: generated species, columns: reconstructed species and PidSelector.FAILED;
+        # sums of weights and of squared weights
+        self.counts = numpy.zeros((len(ParticleId.mass), PidSelector.FAILED + 1))
+        self.squaredCounts = numpy.zeros(self.counts.shape)
+        self.entries = 0
+
+    # counts events with arrays of generated and reconstructed PIDs and
+    # weights (default: 1)
+    def add(self, pairID, pidReco, weights=None):
+        index = (numpy.asarray(pairID, dtype=numpy.int64) * self.counts.shape[1] +
+                 numpy.asarray(pidReco, dtype=numpy.int64)).ravel()
+        weights = numpy.ones(len(index)) if weights is None else numpy.asarray(weights, dtype=float).ravel()
+        self.counts += numpy.bincount(index, weights, minlength=self.counts.size).reshape(self.counts.shape)
+        self.squaredCounts += numpy.bincount(index, weights * weights, minlength=self.counts.size).reshape(self.counts.shape)
+        self.entries += len(index)
+
+    # counts single event
+    def addEvent(self, pairID, pidReco, weight=1.):
+        self.counts[pairID, pidReco] += weight
+        self.squaredCounts[pairID, pidReco] += weight * weight
+        self.entries += 1
+
+    # number of counted events (regardless of weights)
+    def nEvents(self):
+        return self.entries
+
+    # returns (weighted) numbers of pairs passing, total numbers of pairs and
+    # sums of squared weights of the total numbers per species (arrays of 3)
+    def efficiencyCounts(self):
+        diagonal = numpy.diagonal(self.counts)
+        return diagonal, self.counts.sum(axis=1), self.squaredCounts.sum(axis=1)
+
+    def purityCounts(self):
+        diagonal = numpy.diagonal(self.counts)
+        return diagonal, self.counts.sum(axis=0)[:len(diagonal)], self.squaredCounts.sum(axis=0)[:len(diagonal)]
+
+    # returns fractions k/n and their lower and upper uncertainties (arrays);
+    # squaredN is the sum of squared weights of n (default: n, unweighted
+    # counts); fractions with n = 0 are NaN
+    def interval(self, k, n, squaredN=None):
+        k = numpy.asarray(k, dtype=float)
+        n = numpy.asarray(n, dtype=float)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            fraction = k / n
+            if squaredN is not None:
+                # effective numbers of events
+                n = n * n / numpy.asarray(squaredN, dtype=float)
+                k = fraction * n
+            if self.method == "binomial":
+                error = numpy.sqrt(fraction * (1 - fraction) / n)
+                return fraction, error, error
+            zSq = self.z * self.z
+            centre = (k + zSq / 2) / (n + zSq)
+            halfWidth = self.z / (n + zSq) * numpy.sqrt(k * (n - k) / n + zSq / 4)
+        return fraction, fraction - (centre - halfWidth), centre + halfWidth - fraction
+
+    # efficiencies per species with lower and upper uncertainties
+    def efficiencies(self):
+        return self.interval(*self.efficiencyCounts())
+
+    # purities per species with lower and upper uncertainties
+    def purities(self):
+        return self.interval(*self.purityCounts())
+
+    # relative uncertainties (half width of the interval over the value, infinite
+    # where the value is 0 or unknown) of given result of efficiencies or purities
+    @staticmethod
+    def relativeErrors(result):
+        (fraction, lower, upper) = result
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            relativeError = (lower + upper) / (2 * fraction)
+        return numpy.where(fraction > 0, relativeError, numpy.inf)
+
+    # largest relative uncertainty among the quantities of the stop condition
+    def maxRelativeError(self):
+        relativeErrors = list(self.relativeErrors(self.efficiencies())[self.species])
+        if self.purity:
+            relativeErrors += list(self.relativeErrors(self.purities())[self.species])
+        return max(relativeErrors)
+
+    # tells whether the target precision has been reached
+    def converged(self):
+        if self.targetRelativeError is None or self.nEvents() < self.minEvents:
+            return False
+        return self.maxRelativeError() < self.targetRelativeError
+
+    # returns JSON-serialisable state (counts) and restores it
+    def getState(self):
+        return {"counts": self.counts.tolist(), "squaredCounts": self.squaredCounts.tolist(), "entries": self.entries}
+
+    def setState(self, state):
+        self.counts[:] = numpy.array(state["counts"], dtype=float)
+        self.squaredCounts[:] = numpy.array(state["squaredCounts"], dtype=float)
+        self.entries = state["entries"]
+
+    # returns efficiencies and purities with uncertainties as a dictionary
+    def summary(self):
+        summary = {"method": self.method, "z": self.z, "counts": self.counts.tolist(),
+                   "squaredCounts": self.squaredCounts.tolist()}
+        for (quantity, result) in (("efficiency", self.efficiencies()), ("purity", self.purities())):
+            relativeErrors = self.relativeErrors(result)
+            for pid, name in enumerate(ParticleId.name):
+                summary.setdefault(name, {})[quantity] = {
+                    "value": float(result[0][pid]) if numpy.isfinite(result[0][pid]) else None,
+                    "errorLow": float(result[1][pid]) if numpy.isfinite(result[1][pid]) else None,
+                    "errorHigh": float(result[2][pid]) if numpy.isfinite(result[2][pid]) else None,
+                    "relativeError": float(relativeErrors[pid]) if numpy.isfinite(relativeErrors[pid]) else None}
+        return summary
+
+    # returns one-line description of efficiencies and purities
+    def describe(self):
+        (efficiency, efficiencyLow, efficiencyHigh) = self.efficiencies()
+        (purity, purityLow, purityHigh) = self.purities()
+        parts = []
+        for pid, name in enumerate(ParticleId.name):
+            if self.counts[pid].sum() == 0:
+                continue
+            parts.append(name + " eff. " + format(100 * efficiency[pid], '.2f') + " +" +
+                         format(100 * efficiencyHigh[pid], '.2f') + " -" + format(100 * efficiencyLow[pid], '.2f') +
+                         "%, pur. " + (format(100 * purity[pid], '.2f') + "%" if numpy.isfinite(purity[pid]) else "n/a"))
+        return "; ".join(parts)
@@ -0,0 +1,54 @@
+# Class performing particle identification of exclusive pairs based on
+# the nSigma (dE/dx) and m^2_TOF variables. Cut values are given as data
+# (dictionary with the same keys as PidSelector.defaultCuts) and whole
+# arrays of reconstructed events are classified in one call
+
+from ParticleId import *
+import numpy
+
+
+class PidSelector:
+    # pidReco of pairs which have not been identified
+    FAILED = len(ParticleId.mass)
+    # category of pairs which do not enter any of the mhSqMassTofPid histograms
+    NOCATEGORY = -1
+
+    defaultCuts = {"nSigma": 3.,
+                   "mSquaredProton": (0.7, 1.1),
+                   "mSquaredKaon": (0.2, 0.32)}
+
+    def __init__(self, cuts=None):
+        self.cuts = dict(self.defaultCuts)
+        if cuts is not None:
+            self.cuts.update(cuts)
+
+    # classifies events given nSigma of shape (n, 2, 3) and mSquared of shape (n,);
+    # returns sqrt-sums of nSigma over both tracks (n, 3), reconstructed PID (n,)
+    # and the PID category used for the mhSqMassTofPid histograms (n,)
+    def classify(self, nSigma, mSquared):
+        nSigma = numpy.asarray(nSigma, dtype=float)
+        mSquared = numpy.asarray(mSquared, dtype=float)
+        cut = self.cuts["nSigma"]
+        sqRootNSigma = numpy.sqrt(numpy.sum(nSigma * nSigma, axis=-2))
+        (pion, kaon, proton) = (sqRootNSigma[..., ParticleId.PION], sqRootNSigma[..., ParticleId.KAON],
+                                sqRootNSigma[..., ParticleId.PROTON])
+        protonNSigma = (pion > cut) & (kaon > cut) & (proton < cut)
+        kaonNSigma = (pion > cut) & (kaon < cut) & (proton > cut)
+        pionNSigma = (nSigma[..., 0, ParticleId.PION] < cut) & (nSigma[..., 1, ParticleId.PION] < cut)
+        protonMSquared = (mSquared > self.cuts["mSquaredProton"][0]) & (mSquared < self.cuts["mSquaredProton"][1])
+        kaonMSquared = (mSquared > self.cuts["mSquaredKaon"][0]) & (mSquared < self.cuts["mSquaredKaon"][1])
+
+        # conditions are applied in reverse order of priority
+        pidReco = numpy.where(pionNSigma, ParticleId.PION, self.FAILED)
+        pidReco = numpy.where(kaonNSigma & kaonMSquared, ParticleId.KAON, pidReco)
+        pidReco = numpy.where(protonNSigma & protonMSquared, ParticleId.PROTON, pidReco)
+
+        category = numpy.where(pidReco == ParticleId.PION, ParticleId.PION, self.NOCATEGORY)
+        category = numpy.where(kaonNSigma, ParticleId.KAON, category)
+        category = numpy.where(protonNSigma, ParticleId.PROTON, category)
+        return sqRootNSigma, pidReco, category
+
+    # classifies single event (ExclusiveEvent), returns scalar results of classify
+    def classifyEvent(self, evt):
+        (sqRootNSigma, pidReco, category) = self.classify(evt.nSigma, evt.mSquared)
+        return sqRootNSigma, int(pidReco), int(category)
@@ -0,0 +1,282 @@
+# Renders plots (PDF files) from the histograms stored in the analysis
+# output file by PlottingHistograms.writeHistograms, separately from the
+# simulation run. Plots are rendered in parallel, one per process; a plot
+# is skipped if its PDF exists and its inputs (histograms, number of events,
+# dE/dx data) did not change since the last rendering, which is recorded in
+# a state file next to the PDFs. Histograms are rebinned as clones, the
+# analysis output file is only read
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import numpy
+
+
+# renders one plot and returns tuple (plot name, digest of its inputs, rendered);
+# task is a tuple (plot name, analysis output file, output directory,
+# digest of the last rendering or None, number of events or None)
+def renderPlot(task):
+    import ROOT
+    ROOT.gROOT.SetBatch(True)
+    (name, fileName, outputDir, lastDigest, nEvents) = task
+    inputFile = ROOT.TFile.Open(fileName, "READ")
+    histograms = [inputFile.Get(histogramName) for histogramName in PlotRenderer.plots[name]]
+    if nEvents is None:
+        parameter = inputFile.Get("nEvents")
+        if not parameter:
+            raise RuntimeError("PlotRenderer: " + fileName + " has no number of events, give it with --nEvents")
+        nEvents = parameter.GetVal()
+    dEdxFile = ROOT.TFile.Open(PlotRenderer.dEdxDataFile, "READ") if name == "sqMassFromTof" else None
+    hdEdx = dEdxFile.Get("DEdxVsMomentum") if dEdxFile else None
+
+    digest = hashlib.sha1((PlotRenderer.version + name).encode())
+    for histogram in histograms:
+        digest.update(PlotRenderer.histogramContents(histogram).tobytes())
+    if hdEdx:
+        digest.update(numpy.array([nEvents, hdEdx.GetEntries()], dtype=float).tobytes())
+    digest = digest.hexdigest()
+    outputFile = os.path.join(outputDir, name + ".pdf")
+    rendered = digest != lastDigest or not os.path.exists(outputFile)
+    if rendered:
+        getattr(PlotRenderer, PlotRenderer.drawFunctions.get(name, "drawSqMassTofVsSqRootNSigma"))(
+            histograms, outputFile, name=name, nEvents=nEvents, hdEdx=hdEdx)
+    if dEdxFile:
+        dEdxFile.Close()
+    inputFile.Close()
+    return (name, digest, rendered)
+
+
+class PlotRenderer:
+    # changing drawing code should change version, so that all plots are rendered again
+    version = "1"
+    dEdxDataFile = "dEdxData.root"
+    names = ("pion", "kaon", "proton")
+    # input histograms per plot; the plot is written to <plot name>.pdf
+    plots = dict([("sqMassFromTof", ["SqMassTof"] + ["SqMassTofPid_" + pid for pid in names])] +
+                 [("SqMassTofVsSqRootNSigma_" + pid,
+                   ["m^{2}_{TOF} vs. #sqrt{n#sigma_{" + pid + ",1}^{2} + n#sigma_{" + pid + ",2}^{2}}"])
+                  for pid in names] +
+                 [("SqRootNSigmaPionVsKaon", ["SqRootNSigmaPionVsKaon"]),
+                  ("SqRootNSigmaKaonVsProton", ["SqRootNSigmaKaonVsProton"]),
+                  ("SqRootNSigmaPionVsProton", ["SqRootNSigmaPionVsProton"]),
+                  ("PidEfficiency", ["hPidRecoVsPidGenerated"])])
+    # drawing function per plot (default: drawSqMassTofVsSqRootNSigma)
+    drawFunctions = {"sqMassFromTof": "drawSqMassFromTof",
+                     "SqRootNSigmaPionVsKaon": "drawSqRootNSigmaVsSqRootNSigma",
+                     "SqRootNSigmaKaonVsProton": "drawSqRootNSigmaVsSqRootNSigma",
+                     "SqRootNSigmaPionVsProton": "drawSqRootNSigmaVsSqRootNSigma",
+                     "PidEfficiency": "drawPidEfficiency"}
+    # axis titles of the n sigma vs. n sigma plots
+    nSigmaAxes = {"SqRootNSigmaPionVsKaon": ("kaon", "pion"),
+                  "SqRootNSigmaKaonVsProton": ("proton", "kaon"),
+                  "SqRootNSigmaPionVsProton": ("proton", "pion")}
+
+    # fileName is the analysis output file; nEvents overrides the number
+    # of events stored in it; with force=True all plots are rendered
+    def __init__(self, fileName="Output/analysisOutput.root", outputDir="Output", nProcesses=None, nEvents=None,
+                 force=False):
+        self.fileName = fileName
+        self.outputDir = outputDir
+        self.nProcesses = nProcesses if nProcesses else multiprocessing.cpu_count()
+        self.nEvents = nEvents
+        self.force = force
+        self.stateFile = os.path.join(outputDir, "renderState.json")
+
+    # renders plots (all by default) whose inputs changed and returns names of rendered plots
+    def render(self, names=None):
+        names = sorted(self.plots) if names is None else names
+        state = self.readState()
+        tasks = [(name, self.fileName, self.outputDir, None if self.force else state.get(name), self.nEvents)
+                 for name in names]
+        pool = multiprocessing.Pool(min(self.nProcesses, len(tasks)))
+        try:
+            results = pool.map(renderPlot, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        for (name, digest, rendered) in results:
+            state[name] = digest
+        self.writeState(state)
+        return [name for (name, digest, rendered) in results if rendered]
+
+    def readState(self):
+        if not os.path.exists(self.stateFile):
+            return {}
+        with open(self.stateFile) as stateFile:
+            return json.load(stateFile)
+
+    def writeState(self, state):
+        temporaryFile = self.stateFile + ".tmp"
+        with open(temporaryFile, "w") as stateFile:
+            json.dump(state, stateFile, indent=1, sort_keys=True)
+        os.rename(temporaryFile, self.stateFile)
+
+    # returns bin contents (including under/overflows) and number of entries of histogram
+    @staticmethod
+    def histogramContents(histogram):
+        nCells = histogram.GetNcells()
+        contents = numpy.fromiter((histogram.GetBinContent(i) for i in range(nCells)), dtype=float, count=nCells)
+        return numpy.append(contents, histogram.GetEntries())
+
+    @staticmethod
+    def canvas(width, height, leftMargin, logz=True):
+        import ROOT
+        c = ROOT.TCanvas("c", "c", width, height)
+        c.SetLeftMargin(leftMargin)
+        c.SetRightMargin(0.03)
+        c.SetTopMargin(0.04)
+        c.SetBottomMargin(0.1 if width != height else 0.09)
+        if logz:
+            c.SetLogz()
+        return c
+
+    @staticmethod
+    def latex():
+        import ROOT
+        l = ROOT.TLatex(.7, .15, "(log z-scale)")
+        l.SetNDC()
+        l.SetTextFont(42)
+        l.SetTextSize(.05)
+        return l
+
+    # draws dashed vertical line from 0.3 to top
+    @staticmethod
+    def cutLine(x, top, color):
+        import ROOT
+        line = ROOT.TLine(x, 0.3, x, top)
+        line.SetLineColor(color)
+        line.SetLineWidth(2)
+        line.SetLineStyle(7)
+        line.Draw()
+        return line
+
+    # m^2_TOF of all pairs and of pairs identified by dE/dx, scaled to the
+    # number of pairs in the dE/dx data
+    @staticmethod
+    def drawSqMassFromTof(histograms, outputFile, nEvents, hdEdx, **kwargs):
+        import ROOT
+        from PidSelector import PidSelector
+        ROOT.gStyle.SetOptStat(0)
+        ROOT.gStyle.SetOptTitle(0)
+        c = PlotRenderer.canvas(800, 600, 0.08, logz=False)
+        c.SetLogy()
+        colors = [ROOT.kBlack, ROOT.kRed, ROOT.kGreen+3, ROOT.kBlue]
+        rebinned = [histogram.Rebin(4, histogram.GetName() + "Rebinned") for histogram in histograms]
+        for i, histogram in enumerate(rebinned):
+            histogram.SetLineColor(colors[i])
+            histogram.SetLineWidth(2 if i == 0 else 1)
+            if i > 0:
+                histogram.SetFillColorAlpha(colors[i], 0.3)
+            histogram.Scale((hdEdx.GetEntries()/2) / nEvents)
+        (allPairs, pion, kaon, proton) = rebinned
+
+        allPairs.GetXaxis().SetTitle("m_{TOF}^{2} [GeV^{2}/c^{4}]")
+        allPairs.GetXaxis().SetTitleOffset(1.1)
+        allPairs.GetYaxis().SetRangeUser(0.5, 7.2e4)
+        allPairs.GetYaxis().SetTitleOffset(1.03)
+        binWidthSqMass = allPairs.GetBinWidth(1)
+        allPairs.GetYaxis().SetTitle("Number of track pairs / "+format(binWidthSqMass, '.2f')+" GeV^{2}c^{-4}")
+        allPairs.Draw("HIST")
+        pion.Draw("HIST SAME")
+        kaon.Draw("HIST SAME")
+        proton.Draw("HIST SAME")
+
+        legend = ROOT.TLegend(0.6, 0.65, 0.89, 0.89)
+        legend.SetBorderSize(0)
+        legend.SetTextSize(0.04)
+        legend.SetHeader("Pair PID based on dE/dx")
+        legend.AddEntry(allPairs, "All pairs (before PID)", "l")
+        legend.AddEntry(pion, "#pi^{+}#pi^{-}", "fl")
+        legend.AddEntry(kaon, "K^{+}K^{-}", "fl")
+        legend.AddEntry(proton, "p#bar{p}", "fl")
+        legend.Draw()
+
+        lines = []
+        for (window, histogram, color) in [(PidSelector.defaultCuts["mSquaredKaon"], kaon, ROOT.kGreen+3),
+                                           (PidSelector.defaultCuts["mSquaredProton"], proton, ROOT.kBlue)]:
+            for x in window:
+                lines.append(PlotRenderer.cutLine(x, 2*histogram.GetMaximum(), color))
+        c.Print(outputFile, "pdf")
+
+    # m^2_TOF vs. n sigma of the pair for one mass hypothesis
+    @staticmethod
+    def drawSqMassTofVsSqRootNSigma(histograms, outputFile, name, **kwargs):
+        import ROOT
+        ROOT.gStyle.SetOptStat(0)
+        ROOT.gStyle.SetOptTitle(0)
+        pid = name.split("_")[-1]
+        c = PlotRenderer.canvas(800, 800, 0.09)
+        histogram = histograms[0].Rebin2D(2, 2, histograms[0].GetName() + "Rebinned")
+        histogram.GetXaxis().SetTitle("n#sigma_{"+pid+"}^{pair}   ")
+        histogram.GetXaxis().SetTitleOffset(1.05)
+        histogram.GetYaxis().SetTitle("m_{TOF}^{2} [GeV^{2}/c^{4}]")
+        histogram.GetYaxis().SetTitleOffset(1.18)
+        histogram.Draw("col")
+        line = ROOT.TLine(3, -0.6, 3, 1.55)
+        line.SetLineWidth(4)
+        line.SetLineStyle(9)
+        line.Draw()
+        l = PlotRenderer.latex()
+        l.DrawLatex(.7, .15, "(log z-scale)")
+        c.Print(outputFile, "pdf")
+
+    # n sigma of the pair for one mass hypothesis vs. another one
+    @staticmethod
+    def drawSqRootNSigmaVsSqRootNSigma(histograms, outputFile, name, **kwargs):
+        import ROOT
+        ROOT.gStyle.SetOptStat(0)
+        ROOT.gStyle.SetOptTitle(0)
+        (xName, yName) = PlotRenderer.nSigmaAxes[name]
+        c = PlotRenderer.canvas(800, 800, 0.09)
+        histogram = histograms[0]
+        histogram.GetXaxis().SetTitle("n#sigma_{"+xName+"}^{pair}   ")
+        histogram.GetYaxis().SetTitle("n#sigma_{"+yName+"}^{pair}   ")
+        histogram.GetXaxis().SetTitleOffset(1.05)
+        histogram.GetYaxis().SetTitleOffset(1.18)
+        histogram.GetXaxis().SetRangeUser(0,35)
+        histogram.GetYaxis().SetRangeUser(0,35)
+        histogram.Draw("col")
+        lines = [ROOT.TLine(3, -2, 3, 37), ROOT.TLine(-2, 3, 37, 3)]
+        for line in lines:
+            line.SetLineWidth(4)
+            line.SetLineStyle(9)
+            line.Draw()
+        l = PlotRenderer.latex()
+        l.DrawLatex(.52, .85, "Exclusive candidates")
+        l.DrawLatex(.7, .8, "(log z-scale)")
+        c.Print(outputFile, "pdf")
+
+    # reconstructed vs. generated PID
+    @staticmethod
+    def drawPidEfficiency(histograms, outputFile, **kwargs):
+        import ROOT
+        ROOT.gStyle.SetOptStat(0)
+        ROOT.gStyle.SetOptTitle(1)
+        c2 = ROOT.TCanvas("c", "c", 800, 800)
+        c2.SetLogz()
+        histogram = histograms[0]
+        for i, label in enumerate(["Pion", "Kaon", "Proton"]):
+            histogram.GetXaxis().SetBinLabel(i + 1, label)
+            histogram.GetYaxis().SetBinLabel(i + 1, label)
+        histogram.GetYaxis().SetBinLabel(4, "PID failed")
+        histogram.GetXaxis().SetTitle("PID at true level")
+        histogram.Draw("colz text")
+        c2.Print(outputFile)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render plots from the analysis output file")
+    parser.add_argument("fileName", nargs="?", default="Output/analysisOutput.root")
+    parser.add_argument("--outputDir", default="Output", help="directory for PDF files")
+    parser.add_argument("--plots", nargs="+", default=None, choices=sorted(PlotRenderer.plots),
+                        help="plots to render (default: all)")
+    parser.add_argument("--processes", type=int, default=None, help="number of processes (default: number of cores)")
+    parser.add_argument("--nEvents", type=float, default=None,
+                        help="number of simulated events (default: the one stored in the file)")
+    parser.add_argument("--force", action="store_true", help="render also plots whose inputs did not change")
+    args = parser.parse_args()
+    rendered = PlotRenderer(args.fileName, args.outputDir, args.processes, args.nEvents, args.force).render(args.plots)
+    print("PlotRenderer: rendered " + str(len(rendered)) + " plot(s)" +
+          (": " + ", ".join(rendered) if rendered else ", all plots up to date"))
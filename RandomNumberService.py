@@ -0,0 +1,61 @@
+# Class providing the random numbers of the simulation as independent named
+# streams (numpy Philox) keyed by seed, worker and stream, with JSON state
+
+import numpy
+
+
+class RandomNumberService:
+    streamNames = ("vertex", "pid", "dEdx", "tofTime", "momentumSmearing", "genex")
+
+    # constructor; seed 0 means seeding from the operating system entropy
+    # (the seed actually used is kept in self.seed), worker is the index
+    # of the parallel worker the streams belong to
+    def __init__(self, seed=0, worker=0):
+        self.seed = seed if seed != 0 else int(numpy.random.SeedSequence().entropy)
+        self.worker = worker
+        self.streams = {}
+        for index, name in enumerate(self.streamNames):
+            sequence = numpy.random.SeedSequence(self.seed, spawn_key=(worker, index))
+            self.streams[name] = numpy.random.Generator(numpy.random.Philox(sequence))
+
+    # returns numpy Generator of the stream (e.g. to be handed to GenExSample)
+    def stream(self, name):
+        return self.streams[name]
+
+    # returns uniform numbers from [0, 1) of given size (None: a single float)
+    def uniform(self, name, size=None):
+        return self.streams[name].random(size)
+
+    # returns normal numbers of given size (None: shape of loc and scale)
+    def normal(self, name, loc=0., scale=1., size=None):
+        return self.streams[name].normal(loc, scale, size)
+
+    # returns integers from [low, high) of given size
+    def integers(self, name, low, high, size=None):
+        return self.streams[name].integers(low, high, size)
+
+    # returns JSON-serialisable state of all streams
+    def getState(self):
+        state = {}
+        for name, stream in self.streams.items():
+            bitGeneratorState = stream.bit_generator.state
+            state[name] = {"counter": bitGeneratorState["state"]["counter"].tolist(),
+                           "key": bitGeneratorState["state"]["key"].tolist(),
+                           "buffer": bitGeneratorState["buffer"].tolist(),
+                           "bufferPosition": bitGeneratorState["buffer_pos"],
+                           "hasUint32": bitGeneratorState["has_uint32"],
+                           "uinteger": bitGeneratorState["uinteger"]}
+        return state
+
+    # restores state returned by getState
+    def setState(self, state):
+        for name, stream in self.streams.items():
+            streamState = state[name]
+            stream.bit_generator.state = {
+                "bit_generator": "Philox",
+                "state": {"counter": numpy.array(streamState["counter"], dtype=numpy.uint64),
+                          "key": numpy.array(streamState["key"], dtype=numpy.uint64)},
+                "buffer": numpy.array(streamState["buffer"], dtype=numpy.uint64),
+                "buffer_pos": streamState["bufferPosition"],
+                "has_uint32": streamState["hasUint32"],
+                "uinteger": streamState["uinteger"]}
@@ -0,0 +1,137 @@
+# Class monitoring a simulation run: progress, time spent in the stages,
+# GenEx rejections, PID efficiencies, profiling and a JSON summary at the end
+
+import cProfile
+import datetime
+import json
+import os
+import pstats
+import timeit
+
+
+class RunMonitor:
+    # reportInterval in seconds (None: no progress reports); summaryFile
+    # (None: summary only printed); profiler is True for cProfile or an object
+    # with enable() and disable() methods (e.g. a sampling profiler), statistics
+    # of cProfile are written to profileFile
+    def __init__(self, nEvents, reportInterval=10., summaryFile="Output/runSummary.json", profiler=None,
+                 profileFile="Output/runProfile.prof"):
+        self.nEvents = int(nEvents)
+        self.reportInterval = reportInterval
+        self.summaryFile = summaryFile
+        self.profiler = cProfile.Profile() if profiler is True else profiler
+        self.profileFile = profileFile
+        self.stageTimes = {}
+        self.generator = None
+        self.efficiency = None
+
+    # starts monitoring of a run which has already eventsDone events
+    # processed (e.g. resumed from a checkpoint) with given EventGenerator
+    # and PidEfficiency accumulator (both optional)
+    def start(self, eventsDone=0, generator=None, efficiency=None):
+        self.eventsAtStart = eventsDone
+        self.eventsDone = eventsDone
+        self.generator = generator
+        self.efficiency = efficiency
+        if generator is not None:
+            self.trackingTimeAtStart = generator.trackingTime
+            self.GenExReadAtStart = list(generator.nGenExRead)
+            self.GenExRejectedAtStart = list(generator.nGenExRejected)
+        self.startTime = timeit.default_timer()
+        self.lastReport = self.startTime
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    # returns time to be passed to stop
+    def now(self):
+        return timeit.default_timer()
+
+    # adds time elapsed since startTime (returned by now) to the stage
+    def stop(self, stage, startTime):
+        self.stageTimes[stage] = self.stageTimes.get(stage, 0.) + timeit.default_timer() - startTime
+
+    # counts nEvents processed events and reports progress if reportInterval elapsed
+    def update(self, nEvents=1):
+        self.eventsDone += nEvents
+        if self.reportInterval is None:
+            return
+        now = timeit.default_timer()
+        if now - self.lastReport >= self.reportInterval:
+            self.lastReport = now
+            self.report(now)
+
+    def report(self, now):
+        rate = self.rate(now)
+        eta = (self.nEvents - self.eventsDone) / rate if rate > 0 else 0
+        print("RunMonitor: " + str(self.eventsDone) + "/" + str(self.nEvents) + " events (" +
+              format(100. * self.eventsDone / self.nEvents, '.1f') + "%), " + format(rate, '.1f') +
+              " events/s, ETA " + str(datetime.timedelta(seconds=int(eta))))
+        if self.efficiency is not None and self.efficiency.nEvents() > 0:
+            print("RunMonitor:   PID " + self.efficiency.describe())
+
+    # events per second processed since start
+    def rate(self, now):
+        return (self.eventsDone - self.eventsAtStart) / (now - self.startTime) if now > self.startTime else 0.
+
+    # stage times; time of tracking, done within the generation, is subtracted from the generation
+    def getStageTimes(self):
+        stageTimes = dict(self.stageTimes)
+        if self.generator is not None:
+            stageTimes["tracking"] = self.generator.trackingTime - self.trackingTimeAtStart
+            if "generation" in stageTimes:
+                stageTimes["generation"] -= stageTimes["tracking"]
+        return stageTimes
+
+    # returns summary of the run as a dictionary
+    def summary(self):
+        now = timeit.default_timer()
+        stageTimes = self.getStageTimes()
+        totalStageTime = sum(stageTimes.values())
+        summary = {"eventsDone": self.eventsDone, "eventsProcessed": self.eventsDone - self.eventsAtStart,
+                   "wallTime": now - self.startTime, "eventsPerSecond": self.rate(now),
+                   "stages": dict([(stage, {"time": time, "fraction": time / totalStageTime if totalStageTime > 0 else 0.})
+                                   for stage, time in stageTimes.items()])}
+        if self.generator is not None:
+            from ParticleId import ParticleId
+            GenEx = {}
+            for pid, sample in enumerate(self.generator.GenExSamples):
+                if sample is None:
+                    continue
+                read = self.generator.nGenExRead[pid] - self.GenExReadAtStart[pid]
+                rejected = self.generator.nGenExRejected[pid] - self.GenExRejectedAtStart[pid]
+                GenEx[ParticleId.name[pid]] = {"read": read, "rejected": rejected,
+                                               "rejectedFraction": float(rejected) / read if read > 0 else 0.,
+                                               "preFilterAcceptance": sample.acceptanceFraction}
+            summary["GenEx"] = GenEx
+        if self.efficiency is not None:
+            summary["pidEfficiency"] = self.efficiency.summary()
+        if self.profiler is not None and isinstance(self.profiler, cProfile.Profile):
+            summary["profile"] = self.profileFile
+        return summary
+
+    # stops profiling, prints the summary and writes it to summaryFile
+    def finish(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            if isinstance(self.profiler, cProfile.Profile):
+                self.profiler.dump_stats(self.profileFile)
+        summary = self.summary()
+        print("RunMonitor: " + str(summary["eventsProcessed"]) + " events in " +
+              format(summary["wallTime"], '.1f') + " s (" + format(summary["eventsPerSecond"], '.1f') + " events/s)")
+        for stage, stageSummary in sorted(summary["stages"].items(), key=lambda item: -item[1]["time"]):
+            print("RunMonitor:   " + stage + ": " + format(stageSummary["time"], '.2f') + " s (" +
+                  format(100 * stageSummary["fraction"], '.1f') + "%)")
+        for name, GenEx in sorted(summary.get("GenEx", {}).items()):
+            print("RunMonitor:   GenEx " + name + ": " + str(GenEx["rejected"]) + " of " + str(GenEx["read"]) +
+                  " pairs rejected")
+        if self.efficiency is not None and self.efficiency.nEvents() > 0:
+            print("RunMonitor:   PID " + self.efficiency.describe())
+        if self.profiler is not None and isinstance(self.profiler, cProfile.Profile):
+            pstats.Stats(self.profileFile).sort_stats("cumulative").print_stats(15)
+        if self.summaryFile is not None:
+            directory = os.path.dirname(self.summaryFile)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.summaryFile, "w") as summaryFile:
+                json.dump(summary, summaryFile, indent=1, sort_keys=True)
+        return summary
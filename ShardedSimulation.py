@@ -0,0 +1,89 @@
+# Driver running the simulation split into shards on a pool of processes.
+# Every shard gets independent random number streams (RandomNumberService
+# of the master seed with the shard index as worker index) and its own
+# starting point in the GenEx samples, and writes histograms to a separate
+# file; shard outputs are merged with hadd semantics (TFileMerger) into
+# a single output file. For given master seed and number of shards results
+# do not depend on the number of processes
+
+import argparse
+import multiprocessing
+import os
+from RandomNumberService import *
+
+
+# simulates one shard and returns the name of its output file;
+# shard is a tuple (index, nShards, nEvents, master seed)
+def runShard(shard):
+    from EventGenerator import EventGenerator
+    from EventReconstruction import EventReconstruction
+    from PlottingHistograms import PlottingHistograms
+    (index, nShards, nEvents, masterSeed) = shard
+    randomNumbers = RandomNumberService(masterSeed, worker=index)
+    gen = EventGenerator(random=randomNumbers)
+    for sample in gen.GenExSamples:
+        if sample is not None:
+            sample.seek(index * len(sample) // nShards)
+    reco = EventReconstruction(gen.dEdxEngine, expectation=gen.dEdxExpectation, random=randomNumbers)
+    fileName = "Output/shard_" + str(index) + ".root"
+    plotHist = PlottingHistograms(nEvents, fileName)
+    for i in range(nEvents):
+        evt = gen.generateEvent()
+        reco.reconstructEvent(evt)
+        plotHist.fillEvent(evt)
+    plotHist.writeHistograms()
+    return fileName
+
+
+class ShardedSimulation:
+    # masterSeed 0 means seeding from the system entropy, the seed used is kept in self.masterSeed
+    def __init__(self, nEvents, masterSeed, nShards=None, nProcesses=None, outputFile="Output/analysisOutput.root"):
+        self.nEvents = int(nEvents)
+        self.masterSeed = RandomNumberService(masterSeed).seed
+        self.nProcesses = nProcesses if nProcesses else multiprocessing.cpu_count()
+        self.nShards = nShards if nShards else self.nProcesses
+        self.outputFile = outputFile
+
+    # returns list of shard descriptions passed to runShard
+    def shards(self):
+        sizes = [self.nEvents // self.nShards + (1 if i < self.nEvents % self.nShards else 0)
+                 for i in range(self.nShards)]
+        return [(i, self.nShards, sizes[i], self.masterSeed) for i in range(self.nShards)]
+
+    # runs all shards, merges their output and returns the merged file name
+    def run(self):
+        if not os.path.exists("Output"):
+            os.makedirs("Output")
+        pool = multiprocessing.Pool(self.nProcesses)
+        try:
+            shardFiles = pool.map(runShard, self.shards(), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        self.merge(shardFiles)
+        for fileName in shardFiles:
+            os.remove(fileName)
+        return self.outputFile
+
+    # adds histograms of all files the way hadd does, in the order of shards
+    def merge(self, fileNames):
+        import ROOT
+        merger = ROOT.TFileMerger(False)
+        merger.OutputFile(self.outputFile, "RECREATE")
+        for fileName in fileNames:
+            merger.AddFile(fileName)
+        if not merger.Merge():
+            raise RuntimeError("ShardedSimulation::merge: merging of shard outputs failed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the simulation in parallel shards")
+    parser.add_argument("nEvents", type=int)
+    parser.add_argument("--seed", type=int, default=1, help="master seed")
+    parser.add_argument("--shards", type=int, default=None, help="number of shards (default: number of processes)")
+    parser.add_argument("--processes", type=int, default=None, help="number of processes (default: number of cores)")
+    args = parser.parse_args()
+    simulation = ShardedSimulation(args.nEvents, args.seed, args.shards, args.processes)
+    simulation.run()
+    from PlotRenderer import PlotRenderer
+    PlotRenderer(simulation.outputFile, nProcesses=args.processes).render()
@@ -0,0 +1,68 @@
+# Class computing squared mass of the pair from TOF, assuming equal masses
+# of the two particles. With L_i = (trkLength_i / c)^2, P_i = p_i^2 and
+# dt = tofTime_0 - tofTime_1 the squared mass x solves a x^2 + b x + c = 0,
+#   a = (L_0/P_0 - L_1/P_1)^2
+#   b = 2 (L_0 - L_1) (L_0/P_0 - L_1/P_1) - 2 dt^2 (L_0/P_0 + L_1/P_1)
+#   c = (dt^2 - L_0 - L_1)^2 - 4 L_0 L_1
+# and is given by the root (-b + sqrt(b^2 - 4ac)) / 2a. The root is evaluated
+# in the form free of cancellation (also for small a) and events without
+# a solution get a status flag instead of a silent NaN
+
+import numpy
+
+
+class SquaredMassSolver:
+    OK = 0
+    NEGATIVE_DISCRIMINANT = 1  # no real solution
+    DEGENERATE = 2  # a = 0 and the root is at infinity
+    INVALID_INPUT = 3  # non-finite or non-positive momenta, lengths or times
+    statusNames = ("OK", "negative discriminant", "degenerate", "invalid input")
+    c = 29.9792  # cm/ns
+
+    # returns squared masses and status flags for arrays (..., 2) of track
+    # lengths [cm], TOF times [ns] and squared momenta [GeV^2/c^2];
+    # squared mass is NaN where status is not OK
+    @staticmethod
+    def solve(trkLength, tofTime, pSquared):
+        trkLength = numpy.asarray(trkLength, dtype=float)
+        tofTime = numpy.asarray(tofTime, dtype=float)
+        pSquared = numpy.asarray(pSquared, dtype=float)
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            LSq = trkLength * trkLength / (SquaredMassSolver.c * SquaredMassSolver.c)
+            (L0, L1, P0, P1) = (LSq[..., 0], LSq[..., 1], pSquared[..., 0], pSquared[..., 1])
+            dtHitSq = (tofTime[..., 0] - tofTime[..., 1]) * (tofTime[..., 0] - tofTime[..., 1])
+            u = L0 / P0 - L1 / P1
+            aEq = u * u
+            bEq = 2 * (L0 - L1) * u - 2 * dtHitSq * (L0 / P0 + L1 / P1)
+            cEq = (dtHitSq - L0 - L1) * (dtHitSq - L0 - L1) - 4 * L0 * L1
+        (mSquared, status) = SquaredMassSolver.solveQuadratic(aEq, bEq, cEq)
+        valid = numpy.isfinite(trkLength).all(axis=-1) & numpy.isfinite(tofTime).all(axis=-1) &\
+                (pSquared > 0).all(axis=-1) & numpy.isfinite(pSquared).all(axis=-1)
+        status = numpy.where(valid, status, SquaredMassSolver.INVALID_INPUT)
+        mSquared = numpy.where(valid, mSquared, numpy.nan)
+        return mSquared, status
+
+    # returns root (-b + sqrt(b^2 - 4ac)) / 2a of a x^2 + b x + c = 0 (a >= 0)
+    # and status flags; with q = -(b + sign(b) sqrt(b^2 - 4ac)) / 2 the root
+    # is c/q for b >= 0 and q/a otherwise
+    @staticmethod
+    def solveQuadratic(aEq, bEq, cEq):
+        with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            discriminant = bEq * bEq - 4 * aEq * cEq
+            sqrtDiscriminant = numpy.sqrt(numpy.maximum(discriminant, 0))
+            q = -0.5 * (bEq + numpy.where(bEq >= 0, sqrtDiscriminant, -sqrtDiscriminant))
+            root = numpy.where(bEq >= 0, cEq / q, q / aEq)
+        status = numpy.where(discriminant < 0, SquaredMassSolver.NEGATIVE_DISCRIMINANT,
+                             numpy.where(numpy.isfinite(root), SquaredMassSolver.OK, SquaredMassSolver.DEGENERATE))
+        # b = 0 and c = 0 give q = 0 and root 0/0 although x = 0 solves the equation
+        root = numpy.where((bEq == 0) & (cEq == 0) & (discriminant >= 0), 0., root)
+        status = numpy.where((bEq == 0) & (cEq == 0) & (discriminant >= 0), SquaredMassSolver.OK, status)
+        return numpy.where(status == SquaredMassSolver.OK, root, numpy.nan), status
+
+    # recomputes squared masses of stored events (EventBatch, e.g. read from
+    # an EventStore) from their track lengths, TOF times and momenta; momenta
+    # are multiplied by momentumSmearing (shape (n, 2)) if given
+    @staticmethod
+    def solveBatch(batch, momentumSmearing=None):
+        p = batch.p if momentumSmearing is None else momentumSmearing * batch.p
+        return SquaredMassSolver.solve(batch.trkLength, batch.tofTime, p * p)
@@ -4,41 +4,278 @@
 import ROOT
 import numpy
 from StarDetectorAcceptance import *
+from MagneticField import *
 
 
 class TrackingSimulation:
-    # constructor
-    def __init__(self):
+    # constructor; propagator selects how tracks are moved to the TOF barrel:
+    # "analytic" intersects the closed-form helix of the uniform solenoid field
+    # with the barrel, "stepping" integrates the equation of motion numerically.
+    # With validate=True every analytic hit is cross-checked against stepping.
+    # field is a MagneticField (default: uniform 0.5 T); the analytic propagator
+    # needs uniform field, with a field map tracks are always stepped
+    def __init__(self, propagator="analytic", validate=False, field=None):
+        assert propagator in ("analytic", "stepping")
         self.elCharge = 1.602176565e-19
-        self.B = 0.5  # T
-        self.BfieldVec = ROOT.TVector3(0, 0, self.B)
+        self.field = field if field is not None else MagneticField(0.5)
+        self.B = self.field.nominal()  # T
+        if not self.field.isUniform():
+            propagator = "stepping"
         self.tofBarrelRadius = 210  # cm
         self.cMperS = 299792458
-        self.timeStep = 1.e-9  # s
+        self.kappa = 0.299792458e-2  # GeV/c per T per cm
+        # adaptive Runge-Kutta integration in path length: tolerated position error
+        # per step, initial, minimal and maximal step, limit of the path length
+        self.stepTolerance = 1.e-6  # cm
+        self.initialStep = 1.  # cm
+        self.minStep = 1.e-4  # cm
+        self.maxStep = 20.  # cm
+        self.maxPathLength = 5000.  # cm
+        self.maxSteps = 100000
+        self.bisectionTolerance = 1.e-9  # cm
+        self.propagator = propagator
+        self.validate = validate
+        self.validationTolerance = 1.  # cm
+        self.maxValidationDeviation = 0.  # cm
         self.ToFhitPosition = [ROOT.TVector3(), ROOT.TVector3()]
         self.R = numpy.empty(2, dtype=float)
+        self.pathLength = numpy.empty(2, dtype=float)
 
-    # returns 3-vector of Lorentz force acting on a particle of given charge, mass
-    # and momentum, passing through the longitudinal magnetic field self.B
-    def F(self, pVec, charge, mass):
-        return (charge * self.elCharge / mass) * pVec.Cross(self.BfieldVec)
+    # returns magnetic field (Bx, By, Bz) [T] at position (x, y, z) [cm]
+    def fieldAt(self, x, y, z):
+        return self.field.at(x, y, z)
 
-    # computes shift of a track in the time interval self.timeStep
-    def computeStep(self, rVec, pVec, charge, lorentzGamma, mass):
-        speed = self.cMperS / ROOT.TMath.Sqrt(1 + pow(mass / pVec.Mag(), 2))
-        rVec += pVec.Unit() * self.timeStep * speed
-        pVec += self.F(pVec, charge, mass) * self.timeStep * (1. / lorentzGamma)
+    # returns derivatives of the track state (x, y, z, px, py, pz) with respect
+    # to path length: direction of motion and Lorentz force [GeV/c per cm]
+    def derivatives(self, state, charge):
+        (x, y, z, px, py, pz) = state
+        (bx, by, bz) = self.fieldAt(x, y, z)
+        p = (px * px + py * py + pz * pz) ** 0.5
+        (ux, uy, uz) = (px / p, py / p, pz / p)
+        qk = charge * self.kappa
+        return (ux, uy, uz, qk * (uy * bz - uz * by), qk * (uz * bx - ux * bz), qk * (ux * by - uy * bx))
+
+    # computes state (x, y, z, px, py, pz) of a track after a step of
+    # stepLength [cm] along its path with the classical Runge-Kutta method
+    def computeStep(self, state, stepLength, charge):
+        k1 = self.derivatives(state, charge)
+        k2 = self.derivatives([v + 0.5 * stepLength * k for (v, k) in zip(state, k1)], charge)
+        k3 = self.derivatives([v + 0.5 * stepLength * k for (v, k) in zip(state, k2)], charge)
+        k4 = self.derivatives([v + stepLength * k for (v, k) in zip(state, k3)], charge)
+        return [v + stepLength / 6. * (a + 2 * b + 2 * c + d) for (v, a, b, c, d) in zip(state, k1, k2, k3, k4)]
+
+    # computes step of stepLength together with two steps of stepLength/2 and
+    # returns the more precise state and an estimate of its position error [cm]
+    def computeStepWithError(self, state, stepLength, charge):
+        fullStep = self.computeStep(state, stepLength, charge)
+        halfStep = self.computeStep(self.computeStep(state, 0.5 * stepLength, charge), 0.5 * stepLength, charge)
+        error = max(abs(halfStep[i] - fullStep[i]) for i in range(3)) / 15.
+        return halfStep, error
 
     # returns the 3-vector with (x,y,z) position of the TOF module, which was
-    # hit by the particle of given charge and four-momentum
+    # hit by the particle of given charge and four-momentum (None if the track
+    # never reaches the TOF barrel)
     def getTofHitPositionVector(self, fourVector, charge, vertexVector):
-        rVec = ROOT.TVector3(vertexVector)
-        while True:
-            self.computeStep(rVec, ROOT.TVector3(fourVector.Px(), fourVector.Py(), fourVector.Pz()), charge,
-                             fourVector.Gamma(), fourVector.M())
-            if not (rVec.Perp() < self.tofBarrelRadius):
+        return self.propagateTrack(fourVector, charge, vertexVector)[0]
+
+    # returns the TOF hit position (as getTofHitPositionVector) and the path
+    # length [cm] from the vertex to it along the track ((None, None) if the
+    # track never reaches the TOF barrel)
+    def propagateTrack(self, fourVector, charge, vertexVector):
+        if self.propagator == "stepping":
+            return self.getTofHitPositionVectorStepping(fourVector, charge, vertexVector)
+        (hitPosition, pathLength) = self.getTofHitPositionVectorAnalytic(fourVector, charge, vertexVector)
+        if self.validate and hitPosition is not None:
+            self.validateHitPosition(hitPosition, fourVector, charge, vertexVector)
+        return hitPosition, pathLength
+
+    # numerical propagation of the track with adaptive step size; the track is
+    # dropped as soon as it leaves StarDetectorAcceptance.zLimits and the last
+    # step is bisected, so the returned position lies on the barrel; returns
+    # the same as propagateTrack
+    def getTofHitPositionVectorStepping(self, fourVector, charge, vertexVector):
+        state = [vertexVector.x(), vertexVector.y(), vertexVector.z(), fourVector.Px(), fourVector.Py(), fourVector.Pz()]
+        stepLength = self.initialStep
+        pathLength = 0.
+        for step in range(self.maxSteps):
+            (newState, error) = self.computeStepWithError(state, stepLength, charge)
+            if error > self.stepTolerance and stepLength > self.minStep:
+                stepLength = max(self.minStep, stepLength * max(0.2, 0.9 * (self.stepTolerance / error) ** 0.2))
+                continue
+            if newState[0] ** 2 + newState[1] ** 2 >= self.tofBarrelRadius ** 2:
+                (hitPosition, partialStep) = self.bisectStep(state, stepLength, charge)
+                return hitPosition, pathLength + partialStep
+            state = newState
+            pathLength += stepLength
+            if not StarDetectorAcceptance.zLimits[0] < state[2] < StarDetectorAcceptance.zLimits[1] or\
+                    pathLength > self.maxPathLength:
+                return None, None
+            growth = 5. if error == 0 else min(5., 0.9 * (self.stepTolerance / error) ** 0.2)
+            stepLength = min(self.maxStep, stepLength * growth)
+        return None, None
+
+    # finds by bisection the part of the step from state (inside the barrel)
+    # of stepLength (ending outside) which ends on the barrel, returns the hit position
+    # and the part of the step
+    def bisectStep(self, state, stepLength, charge):
+        (lower, upper) = (0., stepLength)
+        hit = state
+        while upper - lower > self.bisectionTolerance:
+            middle = 0.5 * (lower + upper)
+            hit = self.computeStep(state, middle, charge)
+            if hit[0] ** 2 + hit[1] ** 2 < self.tofBarrelRadius ** 2:
+                lower = middle
+            else:
+                upper = middle
+        return ROOT.TVector3(hit[0], hit[1], hit[2]), 0.5 * (lower + upper)
+
+    # closed-form intersection of the track helix with the TOF barrel, returns
+    # the same as propagateTrack
+    def getTofHitPositionVectorAnalytic(self, fourVector, charge, vertexVector):
+        (x, y, z, pathLength, reached) = self.propagateToBarrel(
+            vertexVector.x(), vertexVector.y(), vertexVector.z(),
+            fourVector.Px(), fourVector.Py(), fourVector.Pz(), charge)
+        if not reached:
+            return None, None
+        return ROOT.TVector3(float(x), float(y), float(z)), float(pathLength)
+
+    # compares the analytic TOF hit position with the one from the stepping
+    # integrator and reports deviations larger than self.validationTolerance
+    def validateHitPosition(self, hitPosition, fourVector, charge, vertexVector):
+        steppingHit = self.getTofHitPositionVectorStepping(fourVector, charge, vertexVector)[0]
+        if steppingHit is None:
+            print("TrackingSimulation::validateHitPosition: stepping integrator did not reach the TOF barrel")
+            return
+        deviation = (hitPosition - steppingHit).Mag()
+        self.maxValidationDeviation = max(self.maxValidationDeviation, deviation)
+        if deviation > self.validationTolerance:
+            print("TrackingSimulation::validateHitPosition: analytic and stepping TOF hits differ by "
+                  + format(deviation, '.3f') + " cm")
+
+    # intersects helices of tracks starting at the vertex (vx, vy, vz) [cm] with
+    # momentum (px, py, pz) [GeV/c] with the TOF barrel cylinder r = self.tofBarrelRadius;
+    # works on scalars and on numpy arrays of tracks. Returns hit position (x, y, z),
+    # path length from the vertex [cm] and a flag telling whether the barrel has been
+    # reached between the StarDetectorAcceptance.zLimits planes
+    def propagateToBarrel(self, vx, vy, vz, px, py, pz, charge):
+        vx, vy, vz = numpy.asarray(vx, float), numpy.asarray(vy, float), numpy.asarray(vz, float)
+        px, py, pz = numpy.asarray(px, float), numpy.asarray(py, float), numpy.asarray(pz, float)
+        charge = numpy.asarray(charge, float)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            pT = numpy.hypot(px, py)
+            rho = pT / (self.kappa * self.B)  # transverse radius of the helix [cm]
+            omega = -charge / rho  # signed curvature
+            phi0 = numpy.arctan2(py, px)
+            # centre of the helix projection onto the transverse plane
+            xc = vx - numpy.sin(phi0) / omega
+            yc = vy + numpy.cos(phi0) / omega
+            d = numpy.hypot(xc, yc)
+            # intersection of two circles: the barrel and the helix projection
+            a = (self.tofBarrelRadius**2 - rho**2 + d**2) / (2 * d)
+            h = numpy.sqrt(numpy.maximum(self.tofBarrelRadius**2 - a**2, 0))
+            intersects = (d + rho >= self.tofBarrelRadius) & (numpy.abs(d - rho) <= self.tofBarrelRadius)
+            ux, uy = xc / d, yc / d
+            sPerp = None
+            for sign in (1, -1):
+                xHit = a * ux - sign * h * uy
+                yHit = a * uy + sign * h * ux
+                # azimuth of the momentum at the crossing point and the turning
+                # angle needed to get there along the direction of motion
+                phi = numpy.arctan2(omega * (xHit - xc), -omega * (yHit - yc))
+                s = numpy.mod((phi - phi0) * numpy.sign(omega), 2 * numpy.pi) * rho
+                if sPerp is None:
+                    (sPerp, x, y) = (s, xHit, yHit)
+                else:
+                    first = s < sPerp
+                    sPerp = numpy.where(first, s, sPerp)
+                    x = numpy.where(first, xHit, x)
+                    y = numpy.where(first, yHit, y)
+            z = vz + sPerp * pz / pT
+            pathLength = sPerp * numpy.sqrt(pT**2 + pz**2) / pT
+            reached = intersects & (StarDetectorAcceptance.zLimits[0] < z) & (z < StarDetectorAcceptance.zLimits[1])
+        return x, y, z, pathLength, reached
+
+    # vectorized counterpart of getTofHitPositionVectorStepping for arrays of
+    # tracks, each with its own adaptive step; the field is evaluated for all
+    # tracks at once. Returns the same as propagateToBarrel
+    def propagateToBarrelStepping(self, vx, vy, vz, px, py, pz, charge):
+        arrays = numpy.broadcast_arrays(*[numpy.asarray(v, dtype=float) for v in (vx, vy, vz, px, py, pz, charge)])
+        state = numpy.stack(arrays[:6], axis=1).reshape(-1, 6)
+        charge = arrays[6].reshape(-1)
+        n = len(state)
+        stepLength = numpy.full(n, self.initialStep)
+        pathLength = numpy.zeros(n)
+        hits = numpy.zeros((n, 3))
+        reached = numpy.zeros(n, dtype=bool)
+        active = numpy.arange(n)
+        for step in range(self.maxSteps):
+            if len(active) == 0:
                 break
-        return rVec
+            (newState, error) = self.computeStepWithErrorBatch(state[active], stepLength[active], charge[active])
+            rejected = (error > self.stepTolerance) & (stepLength[active] > self.minStep)
+            with numpy.errstate(divide='ignore'):
+                factor = 0.9 * (self.stepTolerance / error) ** 0.2
+            shrunk = numpy.maximum(self.minStep, stepLength[active] * numpy.maximum(0.2, factor))
+            stepLength[active[rejected]] = shrunk[rejected]
+            accepted = ~rejected
+            crossed = accepted & (newState[:, 0] ** 2 + newState[:, 1] ** 2 >= self.tofBarrelRadius ** 2)
+            if numpy.any(crossed):
+                tracks = active[crossed]
+                (hits[tracks], partialStep) = self.bisectStepBatch(state[tracks], stepLength[tracks], charge[tracks])
+                pathLength[tracks] += partialStep
+                reached[tracks] = (StarDetectorAcceptance.zLimits[0] < hits[tracks, 2]) &\
+                                  (hits[tracks, 2] < StarDetectorAcceptance.zLimits[1])
+            moved = accepted & ~crossed
+            tracks = active[moved]
+            state[tracks] = newState[moved]
+            pathLength[tracks] += stepLength[tracks]
+            stepLength[tracks] = numpy.minimum(self.maxStep, stepLength[tracks] * numpy.minimum(5., factor[moved]))
+            lost = ~((StarDetectorAcceptance.zLimits[0] < state[tracks, 2]) &
+                     (state[tracks, 2] < StarDetectorAcceptance.zLimits[1])) | (pathLength[tracks] > self.maxPathLength)
+            done = numpy.zeros(len(active), dtype=bool)
+            done[crossed] = True
+            done[numpy.flatnonzero(moved)[lost]] = True
+            active = active[~done]
+        shape = arrays[0].shape
+        return (hits[:, 0].reshape(shape), hits[:, 1].reshape(shape), hits[:, 2].reshape(shape),
+                pathLength.reshape(shape), reached.reshape(shape))
+
+    # vectorized counterpart of derivatives, state has shape (n, 6)
+    def derivativesBatch(self, state, charge):
+        (bx, by, bz) = self.field.evaluate(state[:, 0], state[:, 1], state[:, 2])
+        u = state[:, 3:] / numpy.sqrt(numpy.sum(state[:, 3:] ** 2, axis=1))[:, numpy.newaxis]
+        qk = (charge * self.kappa)[:, numpy.newaxis]
+        force = numpy.stack([u[:, 1] * bz - u[:, 2] * by, u[:, 2] * bx - u[:, 0] * bz, u[:, 0] * by - u[:, 1] * bx], axis=1)
+        return numpy.concatenate([u, qk * force], axis=1)
+
+    # vectorized counterpart of computeStep, stepLength has shape (n,)
+    def computeStepBatch(self, state, stepLength, charge):
+        h = stepLength[:, numpy.newaxis]
+        k1 = self.derivativesBatch(state, charge)
+        k2 = self.derivativesBatch(state + 0.5 * h * k1, charge)
+        k3 = self.derivativesBatch(state + 0.5 * h * k2, charge)
+        k4 = self.derivativesBatch(state + h * k3, charge)
+        return state + h / 6. * (k1 + 2 * k2 + 2 * k3 + k4)
+
+    # vectorized counterpart of computeStepWithError
+    def computeStepWithErrorBatch(self, state, stepLength, charge):
+        fullStep = self.computeStepBatch(state, stepLength, charge)
+        halfStep = self.computeStepBatch(self.computeStepBatch(state, 0.5 * stepLength, charge), 0.5 * stepLength, charge)
+        error = numpy.max(numpy.abs(halfStep[:, :3] - fullStep[:, :3]), axis=1) / 15.
+        return halfStep, error
+
+    # vectorized counterpart of bisectStep, returns hit positions (n, 3) and parts of the steps
+    def bisectStepBatch(self, state, stepLength, charge):
+        lower = numpy.zeros(len(state))
+        upper = stepLength.copy()
+        hit = state
+        while numpy.max(upper - lower) > self.bisectionTolerance:
+            middle = 0.5 * (lower + upper)
+            hit = self.computeStepBatch(state, middle, charge)
+            inside = hit[:, 0] ** 2 + hit[:, 1] ** 2 < self.tofBarrelRadius ** 2
+            lower = numpy.where(inside, middle, lower)
+            upper = numpy.where(inside, upper, middle)
+        return hit[:, :3], 0.5 * (lower + upper)
 
     # returns True if both exclusive tracks have reached the TOF barrel,
     # otherwise returns False
@@ -46,15 +283,54 @@ class TrackingSimulation:
         skipEvent = False
         for it in range(2):
             self.R[it] = 100 * (ROOT.TVector3(fourVectors[it].Px(), fourVectors[it].Py(), fourVectors[it].Pz()).Mag()) / (0.3 * self.B)
-            if self.R[it] < self.tofBarrelRadius / 2:
+            if self.field.isUniform() and self.R[it] < self.tofBarrelRadius / 2:
+                skipEvent = True
+                break
+            (hitPosition, pathLength) = self.propagateTrack(fourVectors[it], charges[it], vertex)
+            if hitPosition is None:
                 skipEvent = True
                 break
-            self.ToFhitPosition[it] = self.getTofHitPositionVector(fourVectors[it], charges[it], vertex)
+            self.ToFhitPosition[it] = hitPosition
+            self.pathLength[it] = pathLength
             if not StarDetectorAcceptance.zLimits[0] < self.ToFhitPosition[it].z() < StarDetectorAcceptance.zLimits[1]:
                 skipEvent = True
                 break
         return False if skipEvent else True
 
+    # vectorized counterpart of bothTracksReachTOF for arrays of track pairs
+    # (the analytic propagator, or propagateToBarrelStepping with the stepping
+    # one); pVec has shape (n, 2, 3) and vertices (n, 3). Returns flags telling
+    # whether both tracks have reached the TOF barrel, radii of track helices
+    # (n, 2), TOF hit positions (n, 2, 3) and path lengths to them (n, 2)
+    def bothTracksReachTOFBatch(self, pVec, charges, vertices):
+        R = self.getTrackRadiusBatch(pVec)
+        reached = self.passRadiusCutBatch(pVec)
+        hitPositions = numpy.empty(pVec.shape, dtype=float)
+        pathLengths = numpy.empty(pVec.shape[:2], dtype=float)
+        propagate = self.propagateToBarrel if self.propagator == "analytic" else self.propagateToBarrelStepping
+        for it in range(2):
+            (x, y, z, pathLength, trackReached) = propagate(
+                vertices[:, 0], vertices[:, 1], vertices[:, 2],
+                pVec[:, it, 0], pVec[:, it, 1], pVec[:, it, 2], charges[it])
+            hitPositions[:, it, 0] = x
+            hitPositions[:, it, 1] = y
+            hitPositions[:, it, 2] = z
+            pathLengths[:, it] = pathLength
+            reached &= trackReached
+        return reached, R, hitPositions, pathLengths
+
+    # returns radii of track helices (as in bothTracksReachTOF) for pVec of shape (n, 2, 3)
+    def getTrackRadiusBatch(self, pVec):
+        return 100 * numpy.sqrt(numpy.sum(pVec * pVec, axis=2)) / (0.3 * self.B)
+
+    # returns flags telling whether both tracks pass the radius cut of
+    # bothTracksReachTOF (independent of the vertex, applied only in uniform field),
+    # pVec has shape (n, 2, 3)
+    def passRadiusCutBatch(self, pVec):
+        if not self.field.isUniform():
+            return numpy.ones(len(pVec), dtype=bool)
+        return numpy.all(self.getTrackRadiusBatch(pVec) >= self.tofBarrelRadius / 2, axis=1)
+
     # returns list with 3-vectors describing position of the TOF modules
     # thar have been hit by the tracks
     def getToFhitPosition(self):
@@ -63,3 +339,7 @@ class TrackingSimulation:
     # returns list with radii of track helices
     def getTrackRadius(self):
         return self.R
+
+    # returns path lengths [cm] of the tracks from the vertex to the TOF modules
+    def getTrackPathLength(self):
+        return self.pathLength
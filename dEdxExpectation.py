@@ -0,0 +1,56 @@
+# Class caching expected dE/dx of the three mass hypotheses (ParticleId) as
+# a function of momentum: the most probable log(dE/dx) (z) and its RMS at
+# fixed track segment (log2dx) are tabulated once per hypothesis at the nodes
+# of the dE/dx model in log10(beta*gamma), shifted to log10(p) by log10(m).
+# The model is interpolated linearly between its nodes, so linear
+# interpolation of the cached curves in log10(p) reproduces
+# dEdxParametrisation.GetMostProbableZ/GetRmsZ to floating-point rounding.
+# Memory is bounded by 3 x (number of model nodes); one object is shared
+# by the event generator and the reconstruction
+
+from ParticleId import *
+import numpy
+
+
+class dEdxExpectation:
+    def __init__(self, dEdxEngine, log2dx=1.):
+        self.log2dx = log2dx
+        if "fP" in dEdxEngine.fTables:
+            centers = dEdxEngine.fTables["fP"].centers[0]
+        else:
+            axis = dEdxEngine.Histogram("fP").GetXaxis()
+            centers = numpy.array([axis.GetBinCenter(i) for i in range(1, axis.GetNbins() + 1)])
+        # nodes of the model between the limits to which log10(beta*gamma) is clamped
+        inside = (centers > dEdxEngine.fbgL10min) & (centers < dEdxEngine.fbgL10max)
+        log10bg = numpy.concatenate(([dEdxEngine.fbgL10min], centers[inside], [dEdxEngine.fbgL10max]))
+        self.mostProbableZValues = dEdxEngine.GetMostProbableZArray(log10bg, log2dx)
+        self.rmsZValues = dEdxEngine.GetRmsZArray(log10bg, log2dx)
+        self.log10pNodes = [log10bg + numpy.log10(mass) for mass in ParticleId.mass]
+
+    # most probable z (natural log of dE/dx in keV/cm) for hypothesis pid and momenta p
+    def mostProbableZ(self, pid, p):
+        return numpy.interp(numpy.log10(p), self.log10pNodes[pid], self.mostProbableZValues)
+
+    # RMS of z for hypothesis pid and momenta p
+    def rmsZ(self, pid, p):
+        return numpy.interp(numpy.log10(p), self.log10pNodes[pid], self.rmsZValues)
+
+    # returns most probable z and its RMS for arrays of hypotheses pid and momenta p (broadcastable)
+    def expectation(self, pid, p):
+        (pid, p) = numpy.broadcast_arrays(numpy.asarray(pid), numpy.asarray(p, dtype=float))
+        mostProbableZ = numpy.empty(p.shape)
+        rmsZ = numpy.empty(p.shape)
+        for hypothesis in range(len(ParticleId.mass)):
+            selected = pid == hypothesis
+            mostProbableZ[selected] = self.mostProbableZ(hypothesis, p[selected])
+            rmsZ[selected] = self.rmsZ(hypothesis, p[selected])
+        return mostProbableZ, rmsZ
+
+    # returns n sigma of measured dEdx [GeV/cm] for all hypotheses, shape p.shape + (3,)
+    def nSigma(self, dEdx, p):
+        p = numpy.asarray(p, dtype=float)
+        nSigma = numpy.empty(p.shape + (len(ParticleId.mass),))
+        for hypothesis in range(len(ParticleId.mass)):
+            nSigma[..., hypothesis] = numpy.log(dEdx / (1e-6*numpy.exp(self.mostProbableZ(hypothesis, p)))) /\
+                                      (self.rmsZ(hypothesis, p)/7)
+        return nSigma
@@ -0,0 +1,62 @@
+# Class holding the content of a ROOT histogram (TH2 or TH3) of the dE/dx
+# model as numpy grid, with vectorized interpolation between bin centres
+# reproducing TH2::Interpolate / TH3::Interpolate. Inside the range of bin
+# centres both agree to floating-point rounding (relative difference below
+# 1e-12); outside it the value of the edge bin is taken, as ROOT does
+
+import itertools
+import numpy
+
+
+class dEdxLookupTable:
+    # table is built either from the histogram or from already exported
+    # bin centres (one array per axis) and contents (without under/overflows)
+    def __init__(self, histogram=None, centers=None, contents=None):
+        if histogram is not None:
+            (centers, contents) = self.export(histogram)
+        self.centers = tuple(centers)
+        self.contents = contents
+        self.profiles = {}
+
+    # returns bin centres and contents of the histogram as numpy arrays
+    def export(self, histogram):
+        axes = [histogram.GetXaxis(), histogram.GetYaxis(), histogram.GetZaxis()][:histogram.GetDimension()]
+        centers = [numpy.array([axis.GetBinCenter(i) for i in range(1, axis.GetNbins() + 1)]) for axis in axes]
+        # global bin numbers run fastest along x, cells include under/overflows
+        nCells = [len(c) + 2 for c in centers]
+        cells = numpy.fromiter((histogram.GetBinContent(i) for i in range(int(numpy.prod(nCells)))),
+                               dtype=float, count=int(numpy.prod(nCells)))
+        cells = cells.reshape(nCells[::-1]).transpose()
+        contents = numpy.ascontiguousarray(cells[tuple([slice(1, -1)] * len(centers))])
+        return centers, contents
+
+    # interpolates table at given coordinates (one scalar or array per axis)
+    def interpolate(self, *coordinates):
+        if len(self.centers) == 2 and numpy.ndim(coordinates[1]) == 0:
+            return numpy.interp(coordinates[0], self.centers[0], self.profile(float(coordinates[1])))
+        coordinates = numpy.broadcast_arrays(*[numpy.asarray(x, dtype=float) for x in coordinates])
+        lowerBins = []
+        fractions = []
+        for centers, x in zip(self.centers, coordinates):
+            x = numpy.clip(x, centers[0], centers[-1])
+            lowerBin = numpy.clip(numpy.searchsorted(centers, x, side='right') - 1, 0, len(centers) - 2)
+            lowerBins.append(lowerBin)
+            fractions.append((x - centers[lowerBin]) / (centers[lowerBin + 1] - centers[lowerBin]))
+        result = numpy.zeros(coordinates[0].shape, dtype=float)
+        for corner in itertools.product((0, 1), repeat=len(self.centers)):
+            weight = numpy.ones(coordinates[0].shape, dtype=float)
+            for upper, fraction in zip(corner, fractions):
+                weight *= fraction if upper else 1 - fraction
+            result += weight * self.contents[tuple([b + upper for b, upper in zip(lowerBins, corner)])]
+        return result
+
+    # returns (and caches) 2-D table interpolated along y at fixed value,
+    # as a function of the x bin centres
+    def profile(self, y):
+        if y not in self.profiles:
+            centers = self.centers[1]
+            yClamped = min(max(y, centers[0]), centers[-1])
+            upperBin = min(max(numpy.searchsorted(centers, yClamped, side='right'), 1), len(centers) - 1)
+            fraction = (yClamped - centers[upperBin - 1]) / (centers[upperBin] - centers[upperBin - 1])
+            self.profiles[y] = (1 - fraction) * self.contents[:, upperBin - 1] + fraction * self.contents[:, upperBin]
+        return self.profiles[y]
@@ -2,11 +2,32 @@
 # energy loss dE/dx in the Time Projection Chamber
 # in STAR main detector
 
-import ROOT
+import hashlib
+import json
+import math
+import os
+import shutil
+import numpy
+from dEdxLookupTable import *
 
 class dEdxParametrisation:
-    def __init__(self, Tag="p10", MostProbableZShift=0, AverageZShift=0, I70Shift=1, I60Shift=1):
-        self.fTag = ROOT.TString(Tag)
+    fVersion = 1
+    fHistogramNames = (("fP", "bichP"), ("fA", "bichA"), ("fI70", "bichI70"), ("fI60", "bichI60"),
+                       ("fD", "bichD"), ("fRms", "bichRms"), ("fW", "bichW"), ("fPhi", "bichPhi"))
+    fScalarNames = ("fMostProbableZShift", "fAverageZShift", "fI70Shift", "fI60Shift", "fbgL10min",
+                    "fbgL10max", "fdxL2min", "fdxL2max", "fzmin", "fzmax")
+
+    # with LookupTables=True the model histograms are exported once to numpy
+    # grids (dEdxLookupTable) used by all Get* methods and their vectorized
+    # versions; results agree with TH2::Interpolate/TH3::Interpolate to
+    # floating-point rounding (relative difference below 1e-12).
+    # With CacheDir set, the exported grids are stored there (keyed on the model
+    # tag, shift arguments, file path and modification time) and later
+    # constructions memory-map them without opening the ROOT file or importing
+    # ROOT at all
+    def __init__(self, Tag="p10", MostProbableZShift=0, AverageZShift=0, I70Shift=1, I60Shift=1, LookupTables=False,
+                 CacheDir=None):
+        self.fTag = Tag
         self.fP = 0
         self.fA = 0
         self.fI70 = 0
@@ -25,95 +46,201 @@ class dEdxParametrisation:
         self.fdxL2max = 3
         self.fzmin = -4
         self.fzmax = 6
+        self.fTables = {}
+        self.fFile = None
 
-        dir = ROOT.gDirectory
         rootf = "P10T.root"
-        if self.fTag.Contains("pai", ROOT.TString.kIgnoreCase):
+        if "pai" in Tag.lower():
             rootf = "PaiT.root"
-        elif self.fTag.Contains("p10", ROOT.TString.kIgnoreCase):
+        elif "p10" in Tag.lower():
             rootf = "P10T.root"
-        elif self.fTag.Contains("bich", ROOT.TString.kIgnoreCase):
+        elif "bich" in Tag.lower():
             rootf = "BichselT.root"
 
         path = "dEdxModel"
-        file = ROOT.gSystem.Which(path, rootf, ROOT.kReadPermission)
-        if not file:
+        file = os.path.join(path, rootf)
+        if not os.access(file, os.R_OK):
             print("dEdxParameterization::GetFile: File " + rootf + " has not been found in path " + path)
-        else:
-            print("dEdxParameterization::GetFile: File " + rootf + " has been found as " + file)
-            pFile = ROOT.TFile(file)
-
-            self.fP = pFile.Get("bichP")
-            self.fP.SetDirectory(0)
-            self.fA = pFile.Get("bichA")
-            self.fA.SetDirectory(0)
-            self.fI70 = pFile.Get("bichI70")
-            self.fI70.SetDirectory(0)
-            self.fI60 = pFile.Get("bichI60")
-            self.fI60.SetDirectory(0)
-            self.fD = pFile.Get("bichD")
-            self.fD.SetDirectory(0)
-            self.fRms = pFile.Get("bichRms")
-            self.fRms.SetDirectory(0)
-            self.fW = pFile.Get("bichW")
-            self.fW.SetDirectory(0)
-            self.fPhi = pFile.Get("bichPhi")
-            self.fPhi.SetDirectory(0)
-
-            self.fbgL10min = self.fPhi.GetXaxis().GetBinCenter(1) + 1e-7
-            self.fbgL10max = self.fPhi.GetXaxis().GetBinCenter(self.fPhi.GetXaxis().GetNbins()) - 1e-7
-            self.fdxL2min = self.fPhi.GetYaxis().GetBinCenter(1) + 1e-7
-            self.fdxL2max = self.fPhi.GetYaxis().GetBinCenter(self.fPhi.GetYaxis().GetNbins()) - 1e-7
-            self.fzmin = self.fPhi.GetZaxis().GetBinCenter(1) + 1e-7
-            self.fzmax = self.fPhi.GetZaxis().GetBinCenter(self.fPhi.GetZaxis().GetNbins()) - 1e-7
-
-            self.fAXYZ = tuple([self.fPhi.GetXaxis(), self.fPhi.GetYaxis(), self.fPhi.GetZaxis()])
-            self.fnBins = tuple([x.GetNbins() for x in self.fAXYZ])
-            self.fbinW = tuple([x.GetBinWidth(1) for x in self.fAXYZ])
-
-            # set normalization factor to 2.3976 keV/cm at beta*gamma = 4
-            dEdxMIP = 2.39761562607903311 # [keV/cm]
-            MIPBetaGamma10 = ROOT.TMath.Log10(4.)
-            #  fMostProbableZShift = ROOT.TMath.Log(dEdxMIP) - Interpolation(self.fP, MIPBetaGamma10, 1, 0)
-            #  fAverageZShift      = ROOT.TMath.Log(dEdxMIP) - Interpolation(self.fA, MIPBetaGamma10, 1, 0)
-            self.fI70Shift *= dEdxMIP/self.GetI70(MIPBetaGamma10, 1)
-            self.fI60Shift *= dEdxMIP/self.GetI60(MIPBetaGamma10, 1)
-            self.fMostProbableZShift = ROOT.TMath.Log(self.fI70Shift)
-            self.fAverageZShift = self.fMostProbableZShift
+            return
+        self.fFile = file
+        cachePath = None
+        if CacheDir is not None:
+            cachePath = self.CachePath(CacheDir)
+            if self.LoadCache(cachePath):
+                print("dEdxParameterization::GetFile: File " + rootf + " has been loaded from cache " + cachePath)
+                return
+        print("dEdxParameterization::GetFile: File " + rootf + " has been found as " + file)
+        self.LoadHistograms()
+
+        self.fbgL10min = self.fPhi.GetXaxis().GetBinCenter(1) + 1e-7
+        self.fbgL10max = self.fPhi.GetXaxis().GetBinCenter(self.fPhi.GetXaxis().GetNbins()) - 1e-7
+        self.fdxL2min = self.fPhi.GetYaxis().GetBinCenter(1) + 1e-7
+        self.fdxL2max = self.fPhi.GetYaxis().GetBinCenter(self.fPhi.GetYaxis().GetNbins()) - 1e-7
+        self.fzmin = self.fPhi.GetZaxis().GetBinCenter(1) + 1e-7
+        self.fzmax = self.fPhi.GetZaxis().GetBinCenter(self.fPhi.GetZaxis().GetNbins()) - 1e-7
+
+        self.fAXYZ = tuple([self.fPhi.GetXaxis(), self.fPhi.GetYaxis(), self.fPhi.GetZaxis()])
+        self.fnBins = tuple([x.GetNbins() for x in self.fAXYZ])
+        self.fbinW = tuple([x.GetBinWidth(1) for x in self.fAXYZ])
+
+        # set normalization factor to 2.3976 keV/cm at beta*gamma = 4
+        dEdxMIP = 2.39761562607903311 # [keV/cm]
+        MIPBetaGamma10 = math.log10(4.)
+        #  fMostProbableZShift = ROOT.TMath.Log(dEdxMIP) - Interpolation(self.fP, MIPBetaGamma10, 1, 0)
+        #  fAverageZShift      = ROOT.TMath.Log(dEdxMIP) - Interpolation(self.fA, MIPBetaGamma10, 1, 0)
+        self.fI70Shift *= dEdxMIP/self.GetI70(MIPBetaGamma10, 1)
+        self.fI60Shift *= dEdxMIP/self.GetI60(MIPBetaGamma10, 1)
+        self.fMostProbableZShift = math.log(self.fI70Shift)
+        self.fAverageZShift = self.fMostProbableZShift
+
+        if LookupTables or cachePath is not None:
+            for (name, histName) in self.fHistogramNames:
+                self.fTables[name] = dEdxLookupTable(getattr(self, name))
+        if cachePath is not None:
+            self.SaveCache(cachePath)
+
+    # reads model histograms from the ROOT file
+    def LoadHistograms(self):
+        import ROOT
+        pFile = ROOT.TFile(self.fFile)
+        for (name, histName) in self.fHistogramNames:
+            histogram = pFile.Get(histName)
+            histogram.SetDirectory(0)
+            setattr(self, name, histogram)
+        pFile.Close()
+
+    # returns histogram with given attribute name, reading the ROOT file
+    # if the model has been loaded from cache
+    def Histogram(self, name):
+        if isinstance(getattr(self, name), int) and self.fFile is not None:
+            self.LoadHistograms()
+        return getattr(self, name)
+
+    # interpolates model histogram with given attribute name
+    def Interpolate(self, name, *coordinates):
+        if name in self.fTables:
+            return float(self.fTables[name].interpolate(*coordinates))
+        return getattr(self, name).Interpolate(*coordinates)
+
+    # returns cache directory for the model file, the key changes whenever
+    # the cache format, model tag, shift arguments of the constructor (the
+    # cached normalisation depends on them), file path or file modification
+    # time change; to be called before the shifts are normalised
+    def CachePath(self, CacheDir):
+        key = json.dumps([self.fVersion, self.fTag, self.fMostProbableZShift, self.fAverageZShift, self.fI70Shift,
+                          self.fI60Shift, os.path.abspath(self.fFile), os.path.getmtime(self.fFile)])
+        return os.path.join(CacheDir, os.path.basename(self.fFile) + "." + hashlib.sha1(key.encode()).hexdigest()[:16])
+
+    # memory-maps model grids from cache, returns False if the cache is missing
+    def LoadCache(self, cachePath):
+        try:
+            with open(os.path.join(cachePath, "meta.json")) as metaFile:
+                meta = json.load(metaFile)
+        except (IOError, OSError, ValueError):
+            return False
+        if meta.get("version") != self.fVersion:
+            return False
+        for name in self.fScalarNames:
+            setattr(self, name, meta["scalars"][name])
+        for (name, histName) in self.fHistogramNames:
+            centers = [numpy.load(os.path.join(cachePath, histName + "_axis" + str(axis) + ".npy"))
+                       for axis in range(meta["dimensions"][name])]
+            contents = numpy.load(os.path.join(cachePath, histName + ".npy"), mmap_mode="r")
+            self.fTables[name] = dEdxLookupTable(centers=centers, contents=contents)
+        return True
+
+    # writes model grids to cache; the directory is filled under temporary
+    # name and renamed, so concurrent processes never see a partial cache
+    def SaveCache(self, cachePath):
+        temporaryPath = cachePath + ".tmp" + str(os.getpid())
+        if not os.path.exists(temporaryPath):
+            os.makedirs(temporaryPath)
+        meta = {"version": self.fVersion, "tag": self.fTag, "file": os.path.abspath(self.fFile),
+                "scalars": dict([(name, getattr(self, name)) for name in self.fScalarNames]), "dimensions": {}}
+        for (name, histName) in self.fHistogramNames:
+            table = self.fTables[name]
+            numpy.save(os.path.join(temporaryPath, histName + ".npy"), table.contents)
+            for axis, centers in enumerate(table.centers):
+                numpy.save(os.path.join(temporaryPath, histName + "_axis" + str(axis) + ".npy"), centers)
+            meta["dimensions"][name] = len(table.centers)
+        with open(os.path.join(temporaryPath, "meta.json"), "w") as metaFile:
+            json.dump(meta, metaFile)
+        try:
+            os.rename(temporaryPath, cachePath)
+        except OSError:
+            # another process has already written the cache
+            shutil.rmtree(temporaryPath, ignore_errors=True)
 
     def BetaGamma_Dx(self, log10bg, log2dx):
-        log10bg = ROOT.TMath.Max(self.fbgL10min, ROOT.TMath.Min(self.fbgL10max, log10bg))
-        log2dx = ROOT.TMath.Max(self.fdxL2min, ROOT.TMath.Min(self.fdxL2max, log2dx))
+        log10bg = max(self.fbgL10min, min(self.fbgL10max, log10bg))
+        log2dx = max(self.fdxL2min, min(self.fdxL2max, log2dx))
+        return tuple([log10bg, log2dx])
+
+    def BetaGamma_DxArray(self, log10bg, log2dx):
+        log10bg = numpy.clip(log10bg, self.fbgL10min, self.fbgL10max)
+        log2dx = numpy.clip(log2dx, self.fdxL2min, self.fdxL2max)
         return tuple([log10bg, log2dx])
 
     def GetMostProbableZ(self, log10bg, log2dx):
-        log10bg = ROOT.TMath.Max(self.fbgL10min, ROOT.TMath.Min(self.fbgL10max, log10bg))
-        log2dx = ROOT.TMath.Max(self.fdxL2min, ROOT.TMath.Min(self.fdxL2max, log2dx))
-        return self.fMostProbableZShift + self.fP.Interpolate(log10bg, log2dx)
+        log10bg = max(self.fbgL10min, min(self.fbgL10max, log10bg))
+        log2dx = max(self.fdxL2min, min(self.fdxL2max, log2dx))
+        return self.fMostProbableZShift + self.Interpolate("fP", log10bg, log2dx)
+
+    def GetMostProbableZArray(self, log10bg, log2dx):
+        if "fP" in self.fTables:
+            (log10bg, log2dx) = self.BetaGamma_DxArray(log10bg, log2dx)
+            return self.fMostProbableZShift + self.fTables["fP"].interpolate(log10bg, log2dx)
+        return self.EvaluateArray(self.GetMostProbableZ, log10bg, log2dx)
 
     def GetAverageZ(self, log10bg,  log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        return self.fAverageZShift + self.MostProbableZCorrection(log10bg) + self.fA.Interpolate(log10bg, log2dx)
+        return self.fAverageZShift + self.MostProbableZCorrection(log10bg) + self.Interpolate("fA", log10bg, log2dx)
   
     def GetRmsZ(self, log10bg, log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        return self.fRms.Interpolate(log10bg, log2dx)
+        return self.Interpolate("fRms", log10bg, log2dx)
   
+    def GetRmsZArray(self, log10bg, log2dx):
+        if "fRms" in self.fTables:
+            (log10bg, log2dx) = self.BetaGamma_DxArray(log10bg, log2dx)
+            return self.fTables["fRms"].interpolate(log10bg, log2dx)
+        return self.EvaluateArray(self.GetRmsZ, log10bg, log2dx)
+
+    # evaluates scalar method for each element of the log10bg array
+    def EvaluateArray(self, method, log10bg, log2dx):
+        log10bg = numpy.asarray(log10bg, dtype=float)
+        values = numpy.fromiter((method(x, log2dx) for x in log10bg.ravel()), dtype=float, count=log10bg.size)
+        return values.reshape(log10bg.shape)
+
+    # returns maximal absolute difference between the lookup tables and
+    # the ROOT interpolation, evaluated on nPoints values of log10(beta*gamma)
+    def CheckLookupTables(self, log2dx=1., nPoints=1000):
+        log10bg = numpy.linspace(self.fbgL10min, self.fbgL10max, nPoints)
+        deviation = 0.
+        for (name, histName) in self.fHistogramNames:
+            if name not in self.fTables or name == "fPhi":
+                continue
+            histogram = self.Histogram(name)
+            values = self.fTables[name].interpolate(log10bg, log2dx)
+            for x, value in zip(log10bg, values):
+                deviation = max(deviation, abs(value - histogram.Interpolate(x, log2dx)))
+        return deviation
+
     def GetI70(self, log10bg,  log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        return self.fI70Shift*self.fI70.Interpolate(log10bg, log2dx)
+        return self.fI70Shift*self.Interpolate("fI70", log10bg, log2dx)
   
     def GetI60(self, log10bg,  log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        return self.fI60Shift*self.fI60.Interpolate(log10bg, log2dx)
+        return self.fI60Shift*self.Interpolate("fI60", log10bg, log2dx)
   
     def GetMostProbabledEdx(self, log10bg,  log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        return self.fD.Interpolate(log10bg,log2dx)
+        return self.Interpolate("fD", log10bg, log2dx)
   
     def GetdEdxWidth(self, log10bg,  log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        return self.fW.Interpolate(log10bg, log2dx)
+        return self.Interpolate("fW", log10bg, log2dx)
   
     def GetMostProbableZM(self, log10bg,  log2dx):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
@@ -129,43 +256,43 @@ class dEdxParametrisation:
   
     def GetProbability(self, log10bg,  log2dx,  z):
         (log10bg, log2dx) = self.BetaGamma_Dx(log10bg, log2dx)
-        z = ROOT.TMath.Max(self.fzmin, ROOT.TMath.Min(self.fzmax, z))
-        return self.fPhi.Interpolate(log10bg, log2dx, z)
+        z = max(self.fzmin, min(self.fzmax, z))
+        return self.Interpolate("fPhi", log10bg, log2dx, z)
 
     def MostProbableZCorrection(self, log10bg):
         pars = (-3.68846e-03, 4.72944e+00)
-        return pars[0]*ROOT.TMath.Exp(-pars[1]*log10bg)
+        return pars[0]*math.exp(-pars[1]*log10bg)
 
     def I70Correction(self, log10bg):
         pars = (-1.65714e-02, 3.27271e+00)
-        return ROOT.TMath.Exp(pars[0]*ROOT.TMath.Exp(-pars[1]*log10bg))
+        return math.exp(pars[0]*math.exp(-pars[1]*log10bg))
 
     def Tag(self):
-        return self.fTag.Data()
+        return self.fTag
 
     def P(self):
-        return self.fP
+        return self.Histogram("fP")
 
     def A(self):
-        return self.fA
+        return self.Histogram("fA")
 
     def I70(self):
-        return self.fI70
+        return self.Histogram("fI70")
 
     def I60(self):
-        return self.fI60
+        return self.Histogram("fI60")
 
     def D(self):
-        return self.fD
+        return self.Histogram("fD")
 
     def Rms(self):
-        return self.fRms
+        return self.Histogram("fRms")
 
     def W(self):
-        return self.fW
+        return self.Histogram("fW")
 
     def Phi(self):
-        return self.fPhi
+        return self.Histogram("fPhi")
 
     def bgL10min(self):
         return self.fbgL10min
@@ -175,6 +302,7 @@ class dEdxParametrisation:
 
 
 if __name__ == '__main__':
+    import ROOT
     testObject = dEdxParametrisation()
 
     def bichsel70(x, par):
@@ -0,0 +1,63 @@
+# Class drawing dE/dx of tracks from the shape of the Bichsel z distribution
+# (histogram bichPhi of the dE/dx model) instead of a Gaussian. For every
+# log10(beta*gamma) node of the model the density of z at fixed log2dx is
+# turned into an inverse cumulative distribution tabulated at nQuantiles
+# points, so a draw costs one table lookup; between the nodes quantiles are
+# interpolated linearly. The fluctuation around the mode of the distribution
+# is scaled by widthScale (the 1/7 also applied to the RMS in the Gaussian
+# model of EventGenerator.generatedEdx) and added to the most probable z of
+# dEdxExpectation
+
+from ParticleId import *
+import numpy
+
+
+class dEdxSampler:
+    def __init__(self, dEdxEngine, expectation, log2dx=1., nQuantiles=1024, widthScale=1./7):
+        if "fPhi" not in dEdxEngine.fTables:
+            raise ValueError("dEdxSampler: dE/dx model has no lookup table of bichPhi")
+        self.expectation = expectation
+        self.widthScale = widthScale
+        table = dEdxEngine.fTables["fPhi"]
+        (self.log10bg, log2dxCenters, z) = table.centers
+        # density at fixed log2dx, interpolated linearly between the log2dx bins as TH3::Interpolate does
+        log2dx = min(max(log2dx, log2dxCenters[0]), log2dxCenters[-1])
+        upperBin = min(max(numpy.searchsorted(log2dxCenters, log2dx, side='right'), 1), len(log2dxCenters) - 1)
+        fraction = (log2dx - log2dxCenters[upperBin - 1]) / (log2dxCenters[upperBin] - log2dxCenters[upperBin - 1])
+        density = numpy.maximum((1 - fraction) * table.contents[:, upperBin - 1, :] +
+                                fraction * table.contents[:, upperBin, :], 0)
+        # cumulative distribution of the piecewise linear density, one row per log10(beta*gamma) node
+        cdf = numpy.zeros(density.shape)
+        cdf[:, 1:] = numpy.cumsum(0.5 * (density[:, 1:] + density[:, :-1]) * numpy.diff(z), axis=1)
+        u = numpy.linspace(0, 1, nQuantiles)
+        self.quantiles = numpy.empty((len(self.log10bg), nQuantiles))
+        self.modes = z[numpy.argmax(density, axis=1)]
+        for i in range(len(self.log10bg)):
+            if cdf[i, -1] > 0:
+                self.quantiles[i] = numpy.interp(u, cdf[i] / cdf[i, -1], z)
+            else:
+                self.quantiles[i] = self.modes[i]
+
+    # returns draws of z relative to the mode of the distribution for
+    # log10(beta*gamma) and uniform numbers u from [0, 1) (arrays of equal shape)
+    def fluctuation(self, log10bg, u):
+        x = numpy.interp(log10bg, self.log10bg, numpy.arange(len(self.log10bg), dtype=float))
+        node = numpy.minimum(x.astype(int), len(self.log10bg) - 2)
+        fraction = x - node
+        q = u * (self.quantiles.shape[1] - 1)
+        k = numpy.minimum(q.astype(int), self.quantiles.shape[1] - 2)
+        t = q - k
+        lower = (1 - t) * self.quantiles[node, k] + t * self.quantiles[node, k + 1] - self.modes[node]
+        upper = (1 - t) * self.quantiles[node + 1, k] + t * self.quantiles[node + 1, k + 1] - self.modes[node + 1]
+        return (1 - fraction) * lower + fraction * upper
+
+    # returns dE/dx [GeV/cm] of tracks for hypotheses pid and momenta p
+    # (broadcastable arrays) and uniform numbers u of the broadcast shape
+    def sample(self, pid, p, u):
+        (pid, p) = numpy.broadcast_arrays(numpy.asarray(pid), numpy.asarray(p, dtype=float))
+        log10bg = numpy.log10(p / numpy.asarray(ParticleId.mass)[pid])
+        mostProbableZ = numpy.empty(p.shape)
+        for hypothesis in range(len(ParticleId.mass)):
+            selected = pid == hypothesis
+            mostProbableZ[selected] = self.expectation.mostProbableZ(hypothesis, p[selected])
+        return 1E-6*numpy.exp(mostProbableZ + self.widthScale * self.fluctuation(log10bg, numpy.asarray(u, dtype=float)))